@@ -5,8 +5,6 @@ from datetime import timedelta
 from flask import Flask, jsonify, request
 from flask_socketio import SocketIO
 from flask_jwt_extended import JWTManager
-from flask_limiter import Limiter
-from flask_limiter.util import get_remote_address
 from sqlalchemy import text
 
 from .center import center_bp
@@ -15,10 +13,18 @@ from .auth import auth_bp
 from .message import msg_bp
 from .friends import friends_bp
 from .room import room_bp
+from .search import search_bp
+from .upload import upload_bp
+from . import membership, revocation
+from .models import user_profiles
+from .presence import start_presence_tasks
+from .receipts import start_receipt_flusher
+from .typing_status import start_typing_broadcaster
 from .router import register_routes
-from .utils import setup_logger
+from .utils import setup_logger, database_uri
+from .writer import start_writer
 
-def create_app():
+def create_app(test_config=None):
     app = Flask(__name__, static_folder='static', template_folder='templates')
     app.config.from_mapping(
         SECRET_KEY=os.getenv('SECRET_KEY'),
@@ -29,24 +35,41 @@ def create_app():
         JWT_ACCESS_TOKEN_EXPIRES=timedelta(hours=24),  # 访问 Token 有效期为 24 小时
         JWT_REFRESH_TOKEN_EXPIRES=timedelta(days=30),  # 刷新 Token 有效期为 30 天
         JWT_DATETIME_ZONE = "Asia/Shanghai",
-        SQLALCHEMY_DATABASE_URI=(
-            f"mysql+pymysql://{os.getenv('MYSQL_USER')}:{os.getenv('MYSQL_PASSWORD')}"
-            f"@db:3306/{os.getenv('MYSQL_DATABASE')}?charset=utf8mb4"
-        ),
+        SQLALCHEMY_DATABASE_URI=database_uri(),
         SQLALCHEMY_ENGINE_OPTIONS={
             'pool_size': 20,
             'max_overflow': 40,
             'pool_pre_ping': True
         },
-        REDIS_URL=os.getenv('REDIS_URL', 'redis://redis:6379/0')
+        REDIS_URL=os.getenv('REDIS_URL', 'redis://redis:6379/0'),
+        # Socket.IO 跨 worker / 跨节点广播的消息队列（redis:// amqp:// kafka://），置空则只在本进程内广播
+        SOCKETIO_MESSAGE_QUEUE=os.getenv('SOCKETIO_MESSAGE_QUEUE', os.getenv('REDIS_URL', 'redis://redis:6379/0')),
+        SOCKETIO_CHANNEL=os.getenv('SOCKETIO_CHANNEL', 'pychat-socketio'),
+        # 消息异步落库：先广播再由后台批量写入 MySQL
+        MESSAGE_WRITE_BEHIND=os.getenv('MESSAGE_WRITE_BEHIND', '0') == '1',
+        MESSAGE_FLUSH_BATCH=int(os.getenv('MESSAGE_FLUSH_BATCH', 200)),  # 单批最大条数
+        MESSAGE_FLUSH_INTERVAL_MS=int(os.getenv('MESSAGE_FLUSH_INTERVAL_MS', 500)),  # 单批最长等待时间
+        # 已读回执合并后批量落库、聚合广播的周期
+        RECEIPT_FLUSH_INTERVAL_MS=int(os.getenv('RECEIPT_FLUSH_INTERVAL_MS', 1000)),
+        # "谁在输入"快照的广播周期
+        TYPING_SNAPSHOT_INTERVAL_MS=int(os.getenv('TYPING_SNAPSHOT_INTERVAL_MS', 1000)),
+        # 上下线差量的合并推送周期
+        PRESENCE_DIFF_INTERVAL_MS=int(os.getenv('PRESENCE_DIFF_INTERVAL_MS', 1000)),
+        # 请求体上限，与 nginx client_max_body_size 一致；超出时 werkzeug 在解析表单前直接返回 413
+        MAX_CONTENT_LENGTH=int(os.getenv('MAX_CONTENT_LENGTH', 6 * 1024 * 1024))
     )
+    if test_config:
+        app.config.update(test_config)
 
     # 初始化扩展
     db.init_app(app)
     jwt.init_app(app)
-    socketio.init_app(app)
-    limiter = Limiter(app)  # 创建 Limiter 实例
-    limiter.limit("5 per minute")  # 设置速率限制
+    socketio.init_app(
+        app,
+        message_queue=app.config['SOCKETIO_MESSAGE_QUEUE'] or None,
+        channel=app.config['SOCKETIO_CHANNEL']
+    )
+    limiter.init_app(app)  # 启用各蓝图上声明的速率限制
 
     # 注册蓝图
     app.register_blueprint(auth_bp)
@@ -54,10 +77,30 @@ def create_app():
     app.register_blueprint(center_bp)
     app.register_blueprint(friends_bp)
     app.register_blueprint(room_bp)
+    app.register_blueprint(upload_bp)
+    app.register_blueprint(search_bp)
 
     # 注册路由
     register_routes(app)
 
+    # 监听用户资料、房间成员缓存失效通知及 JWT 吊销事件
+    socketio.start_background_task(user_profiles.listen)
+    socketio.start_background_task(membership.listen)
+    socketio.start_background_task(revocation.listen)
+
+    # 启动已读回执批量落库后台任务
+    start_receipt_flusher(app)
+
+    # 启动在线状态心跳、失联清理与差量推送任务
+    start_presence_tasks(app)
+
+    # 启动输入状态快照广播任务
+    start_typing_broadcaster(app)
+
+    # 启动消息批量落库后台任务
+    if app.config['MESSAGE_WRITE_BEHIND']:
+        start_writer(app)
+
     # 日志 JSON 化
     setup_logger(app)
 
@@ -10,8 +10,10 @@ from zoneinfo import ZoneInfo
 from flask import Blueprint, request, jsonify, render_template
 from flask_jwt_extended import create_access_token, create_refresh_token, set_access_cookies, set_refresh_cookies, jwt_required, get_jwt_identity, get_jwt
 from .models import  User
+from .membership import add_members
+from . import name_index
 from .extensions import limiter, jwt
-from .utils import blacklist
+from .revocation import revoke
 
 auth_bp = Blueprint('auth', __name__, url_prefix='/auth')
 
@@ -89,6 +91,9 @@ def reg_post():
 
         user_id = User.generate_user_id()
         User.create(username, password, user_id)
+        # 新用户默认加入房间 1，同步更新已缓存的成员集合
+        add_members(1, [user_id])
+        name_index.index_name(name_index.USER, user_id, username)
         return jsonify({'code': 0, 'user_id': user_id}), 201
     else:
         return jsonify({'code': 1, 'msg': '用户名已存在'}), 400
@@ -96,8 +101,8 @@ def reg_post():
 @auth_bp.route('/logout')
 @jwt_required()
 def logout():
-    jti = get_jwt()["jti"]
-    blacklist.add(jti)
+    token = get_jwt()
+    revoke(token["jti"], token["exp"])
     response = jsonify({'code': 0, 'msg': '您已退出登录。'})
     response.delete_cookie('access_token_cookie')
     response.delete_cookie('refresh_token_cookie')
@@ -0,0 +1,172 @@
+"""
+两级缓存
+- 一级：进程内 LRU，条目带 TTL
+- 二级：Redis Hash
+- 失效通过 Redis pub/sub 广播，所有 worker 同步清除本地条目
+- 布隆过滤器，用于进程内的否定判断
+"""
+import hashlib
+import time
+from collections import OrderedDict
+
+import redis
+
+from .utils import init_redis
+
+r = init_redis()
+
+MISSING = object()
+
+
+class LRUCache:
+    """进程内 LRU 缓存，超过 TTL 的条目视为未命中"""
+
+    def __init__(self, maxsize=10000, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+
+    def get(self, key, default=MISSING):
+        item = self._data.get(key)
+        if item is None:
+            return default
+        value, expires_at = item
+        if expires_at < time.monotonic():
+            self._data.pop(key, None)
+            return default
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key, value):
+        self._data[key] = (value, time.monotonic() + self.ttl)
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+
+class BloomFilter:
+    """布隆过滤器：判定为不存在时一定不存在，判定为存在时可能误判"""
+
+    def __init__(self, size_bits=1 << 20, hashes=7):
+        self.size = size_bits
+        self.hashes = hashes
+        self._bits = bytearray(size_bits // 8)
+
+    def _positions(self, item):
+        # 双重哈希：由一次 blake2b 摘要派生出 k 个位置
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, item):
+        for pos in self._positions(item):
+            self._bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, item):
+        return all(self._bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(item))
+
+
+class ProfileCache:
+    """
+    id -> 资料字典 的两级缓存
+    loader(ids) 负责从数据库批量加载，返回 {id: dict}，不存在的 id 不出现在结果中
+    """
+
+    def __init__(self, name, loader, maxsize=10000, ttl=60, redis_ttl=3600):
+        self.name = name
+        self.loader = loader
+        self.redis_ttl = redis_ttl
+        self.local = LRUCache(maxsize, ttl)
+        self.channel = f'cache:invalidate:{name}'
+        self.stats = {'local_hits': 0, 'redis_hits': 0, 'misses': 0}
+
+    def key(self, id):
+        return f'{self.name}:{id}:profile'
+
+    def get(self, id):
+        return self.get_many([id])[id]
+
+    def get_many(self, ids):
+        result, missing = {}, []
+        for id in ids:
+            profile = self.local.get(id)
+            if profile is MISSING:
+                missing.append(id)
+            else:
+                result[id] = profile
+                self.stats['local_hits'] += 1
+        if not missing:
+            return result
+
+        try:
+            pipe = r.pipeline(transaction=False)
+            for id in missing:
+                pipe.hgetall(self.key(id))
+            cached = pipe.execute()
+        except redis.RedisError:
+            cached = [{}] * len(missing)
+
+        unresolved = []
+        for id, profile in zip(missing, cached):
+            if profile:
+                result[id] = profile
+                self.local.set(id, profile)
+                self.stats['redis_hits'] += 1
+            else:
+                unresolved.append(id)
+        if not unresolved:
+            return result
+
+        self.stats['misses'] += len(unresolved)
+        loaded = self.loader(unresolved)
+        pipe = r.pipeline(transaction=False)
+        for id in unresolved:
+            # 不存在的 id 只在本地做短期负缓存
+            profile = loaded.get(id)
+            result[id] = profile
+            self.local.set(id, profile)
+            if profile:
+                pipe.hset(self.key(id), mapping=profile)
+                pipe.expire(self.key(id), self.redis_ttl)
+        try:
+            pipe.execute()
+        except redis.RedisError:
+            pass
+        return result
+
+    def invalidate(self, id):
+        self.local.pop(id)
+        try:
+            pipe = r.pipeline()
+            pipe.delete(self.key(id))
+            pipe.publish(self.channel, id)
+            pipe.execute()
+        except redis.RedisError:
+            pass
+
+    def listen(self):
+        listen_invalidations(self.channel, self.local)
+
+
+def listen_invalidations(channel, local):
+    """常驻后台：收到失效通知后清除本地条目"""
+    while True:
+        pubsub = r.pubsub(ignore_subscribe_messages=True)
+        try:
+            pubsub.subscribe(channel)
+            for message in pubsub.listen():
+                local.pop(message['data'])
+        except redis.RedisError:
+            # 断线期间可能错过通知，整体清空本地缓存
+            local.clear()
+            time.sleep(1)
+        finally:
+            # 每次重连都会新建 pubsub，旧的必须关闭以归还连接池中的连接
+            pubsub.close()
@@ -1,15 +1,22 @@
+import glob
 import hashlib
 
 import bcrypt
 from flask import Blueprint, request, jsonify, render_template
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from .models import db, User
+from .models import db, User, user_profiles
+from .upload import UPLOAD_DIR, UploadRejected, receive_file
+from . import name_index
 import logging
-from werkzeug.utils import secure_filename
 import os
 
 center_bp = Blueprint('center', __name__, url_prefix='/center')
 
+AVATAR_DIR = os.path.join(UPLOAD_DIR, 'avatar')
+os.makedirs(AVATAR_DIR, exist_ok=True)
+AVATAR_MAX_SIZE = 2 * 1024 * 1024  # 2 MB
+AVATAR_EXT = {'image/jpeg': 'jpg', 'image/png': 'png', 'image/gif': 'gif'}
+
 @center_bp.route('/')
 @jwt_required()
 def center():
@@ -20,16 +27,20 @@ def center():
 @jwt_required()
 def upload_avatar():
     user = get_jwt_identity()
-    if 'avatar' not in request.files:
-        return jsonify({'code': 1, 'msg': '未上传文件'}), 400
 
-    avatar = request.files['avatar']
-    if avatar.filename == '':
-        return jsonify({'code': 1, 'msg': '未选择文件'}), 400
+    # 边接收边写入临时文件，超过大小上限或不是图片时立即中止
+    try:
+        _, tmp_path, mime, content_hash = receive_file('avatar', AVATAR_MAX_SIZE, tuple(AVATAR_EXT))
+    except UploadRejected as e:
+        return jsonify({'code': 1, 'msg': e.msg}), e.status
 
-    filename = secure_filename(avatar.filename)
-    avatar.save(os.path.join('/app/upload', filename))
-    return jsonify({'code': 0, 'msg': '头像上传成功'})
+    # 文件名带内容哈希：nginx 对头像按长期缓存下发，换头像必须换地址，旧头像随之删除
+    filename = f'{user}-{content_hash[:16]}.{AVATAR_EXT[mime]}'
+    os.replace(tmp_path, os.path.join(AVATAR_DIR, filename))
+    for stale in glob.glob(os.path.join(AVATAR_DIR, f'{glob.escape(user)}[-.]*')):
+        if os.path.basename(stale) != filename:
+            os.remove(stale)
+    return jsonify({'code': 0, 'msg': '头像上传成功', 'url': f'/upload/avatar/{filename}'})
 
 @center_bp.post('/update-username')
 @jwt_required()
@@ -45,8 +56,13 @@ def update_username():
     if not user:
         return jsonify({'code': 1, 'msg': '用户不存在'}), 404
 
+    old_username = user.username
     user.username = new_username
     db.session.commit()
+
+    # 通知所有 worker 失效该用户的资料缓存，并更新搜索索引
+    user_profiles.invalidate(user_id)
+    name_index.index_name(name_index.USER, user_id, new_username, old_name=old_username)
     return jsonify({'code': 0, 'msg': '用户名修改成功'})
 
 @center_bp.post('/update-password')
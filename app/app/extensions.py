@@ -4,7 +4,7 @@ from flask_jwt_extended import JWTManager
 from flask_socketio import SocketIO
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
-from .utils import blacklist
+from .revocation import is_revoked
 
 db = SQLAlchemy()
 jwt = JWTManager()
@@ -15,7 +15,7 @@ limiter = Limiter(key_func=get_remote_address)
 @jwt.token_in_blocklist_loader
 def check_if_token_revoked(jwt_header, jwt_payload):
     jti = jwt_payload["jti"]
-    return jti in blacklist
+    return is_revoked(jti)
 
 @jwt.expired_token_loader
 def expired_token_callback(jwt_header, jwt_payload):
@@ -0,0 +1,139 @@
+"""
+好友关系缓存
+- user:{id}:friends 保存用户的好友集合（邻接表），is_friend 只需一次 SISMEMBER
+- 好友列表连同用户名（nameidx:user:names）由 Lua 脚本一次往返取回
+- 通过 / 删除好友时同步更新双方的集合；缓存缺失时从 friendship 表加载并回填
+"""
+import redis
+
+from .models import User, Friendship
+from .name_index import USER, names_key
+from .utils import init_redis, redis_timer
+
+r = init_redis()
+
+LOADED = '-'       # 占位成员，用于区分"未加载"与"没有好友"
+CACHE_TTL = 3600
+
+# 集合未加载时返回 -1
+_is_friend = r.register_script("""
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return -1
+end
+return redis.call('SISMEMBER', KEYS[1], ARGV[1])
+""")
+
+# 集合未加载时返回 nil，否则返回扁平数组 {user_id, username, ...}，未收录的用户名为空串
+_friends_with_names = r.register_script("""
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return false
+end
+local ids = {}
+for _, id in ipairs(redis.call('SMEMBERS', KEYS[1])) do
+    if id ~= ARGV[1] then table.insert(ids, id) end
+end
+if #ids == 0 then return {} end
+local names = redis.call('HMGET', KEYS[2], unpack(ids))
+local out = {}
+for i, id in ipairs(ids) do
+    table.insert(out, id)
+    table.insert(out, names[i] or '')
+end
+return out
+""")
+
+_sadd_if_exists = r.register_script("""
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    redis.call('SADD', KEYS[1], ARGV[1])
+end
+return 0
+""")
+
+
+def friends_key(user_id):
+    return f'user:{user_id}:friends'
+
+
+def _load(user_id):
+    friend_ids = {friend_id for (friend_id,) in Friendship.friend_ids_query(user_id)}
+    try:
+        pipe = r.pipeline()
+        pipe.sadd(friends_key(user_id), LOADED, *friend_ids)
+        pipe.expire(friends_key(user_id), CACHE_TTL)
+        pipe.execute()
+    except redis.RedisError:
+        pass
+    return friend_ids
+
+
+def is_friend(user_id, friend_id):
+    # LOADED 是集合中真实存在的占位成员，不能当作用户 ID 查询
+    if not friend_id or friend_id == LOADED or user_id == friend_id:
+        return False
+    try:
+        with redis_timer('friends.is_friend'):
+            result = _is_friend(keys=[friends_key(user_id)], args=[friend_id])
+    except redis.RedisError:
+        return Friendship.exists(user_id, friend_id)
+    if result == -1:
+        return friend_id in _load(user_id)
+    return result == 1
+
+
+def friends_among(user_id, candidate_ids):
+    """返回 candidate_ids 中是 user_id 好友的集合，一次 SMISMEMBER 完成批量校验"""
+    candidates = [c for c in dict.fromkeys(candidate_ids) if c and c != LOADED and c != user_id]
+    if not candidates:
+        return set()
+    try:
+        pipe = r.pipeline()
+        pipe.exists(friends_key(user_id))
+        pipe.smismember(friends_key(user_id), candidates)
+        with redis_timer('friends.among'):
+            loaded, flags = pipe.execute()
+    except redis.RedisError:
+        loaded = 0
+    if not loaded:
+        return set(candidates) & _load(user_id)
+    return {candidate for candidate, flag in zip(candidates, flags) if flag}
+
+
+def friends_with_names(user_id):
+    """返回 [{'user_id', 'username'}, ...]，缓存命中时只需一次 Redis 往返"""
+    try:
+        with redis_timer('friends.list'):
+            flat = _friends_with_names(keys=[friends_key(user_id), names_key(USER)], args=[LOADED])
+    except redis.RedisError:
+        flat = None
+    if flat is None:
+        friend_ids = _load(user_id)
+        flat = [value for friend_id in friend_ids for value in (friend_id, '')]
+
+    friends = dict(zip(flat[::2], flat[1::2]))
+    # 名称索引中缺失的用户名回退到资料缓存
+    missing = [friend_id for friend_id, username in friends.items() if not username]
+    if missing:
+        friends.update(User.usernames(missing))
+    return [{'user_id': friend_id, 'username': username}
+            for friend_id, username in sorted(friends.items()) if username]
+
+
+def add_friends(user_id, friend_id):
+    """好友关系已提交到数据库后调用"""
+    try:
+        pipe = r.pipeline(transaction=False)
+        _sadd_if_exists(keys=[friends_key(user_id)], args=[friend_id], client=pipe)
+        _sadd_if_exists(keys=[friends_key(friend_id)], args=[user_id], client=pipe)
+        pipe.execute()
+    except redis.RedisError:
+        pass
+
+
+def remove_friends(user_id, friend_id):
+    try:
+        pipe = r.pipeline()
+        pipe.srem(friends_key(user_id), friend_id)
+        pipe.srem(friends_key(friend_id), user_id)
+        pipe.execute()
+    except redis.RedisError:
+        pass
@@ -3,7 +3,10 @@ from flask_jwt_extended import jwt_required, get_jwt_identity
 from sqlalchemy import or_
 
 from . import socketio
-from .models import db, User, FriendRequest, RoomMember, Room
+from .models import User, FriendRequest, Friendship, Room
+from .membership import add_members
+from .friend_graph import is_friend, friends_with_names, add_friends, remove_friends
+from . import name_index
 from flask_socketio import emit
 
 friends_bp = Blueprint('friends', __name__, url_prefix='/friends')
@@ -15,12 +18,19 @@ def search_user():
     if not query:
         return jsonify({'code': 1, 'msg': '查询参数不能为空'}), 400
 
-    users = User.query.filter(
-        (User.username.like(f"%{query}%")) | (User.user_id.like(f"%{query}%"))
-    ).all()
+    offset = max(0, request.args.get('offset', 0, type=int))
+    size = max(1, min(request.args.get('size', 20, type=int), 50))
 
-    user_list = [{'username': user.username, 'user_id': user.user_id} for user in users]
-    return jsonify({'code': 0, 'users': user_list}), 200
+    matches, has_more = name_index.search(name_index.USER, query, offset, size)
+    user_list = [{'username': username, 'user_id': user_id} for user_id, username in matches]
+
+    # user_id 精确匹配直接走主键，排在第一位
+    if offset == 0:
+        exact = User.find_by_id(query)
+        if exact:
+            user_list = [{'username': exact.username, 'user_id': exact.user_id}] + \
+                        [u for u in user_list if u['user_id'] != exact.user_id]
+    return jsonify({'code': 0, 'users': user_list, 'has_more': has_more}), 200
 
 @friends_bp.post('/send_friend_request')
 @jwt_required()
@@ -38,7 +48,7 @@ def send_friend_request():
     if FriendRequest.is_pending(current_user_id, friend_user_id):
         return jsonify({'code': 1, 'msg': '好友请求已发送'}), 400
 
-    if FriendRequest.is_friend(current_user_id, friend_user_id):
+    if is_friend(current_user_id, friend_user_id):
         return jsonify({'code': 1, 'msg': '已经是好友'}), 400
 
     # 检查是否已经发送过好友请求
@@ -65,32 +75,26 @@ def handle_friend_request():
     current_user_id = get_jwt_identity()
     if action == 'accept':
         if FriendRequest.accept_request(user_id, current_user_id):
-            # 创建私聊房间
-            room = Room(group_flag=False, name=None, owner=None)
-            db.session.add(room)
-            db.session.flush()  # 获取room_id但不提交
-
-            # 添加两个用户到房间
-            member1 = RoomMember(room_id=room.room_id, user_id=current_user_id, last_read_seq=0)
-            member2 = RoomMember(room_id=room.room_id, user_id=user_id, last_read_seq=0)
+            add_friends(current_user_id, user_id)
 
-            db.session.add_all([member1, member2])
-            db.session.commit()
+            # 复用双方已有的私聊房间（例如删除好友后重新添加），不存在时才创建
+            room_id, _ = Room.get_or_create_private(current_user_id, user_id)
+            add_members(room_id, [current_user_id, user_id])
 
             # 通知双方有新的私聊房间
             socketio.emit('new_private_chat', {
-                'room_id': room.room_id,
+                'room_id': room_id,
                 'user_id': current_user_id,
                 'friend_user_id': user_id
             }, room=current_user_id)
 
             socketio.emit('new_private_chat', {
-                'room_id': room.room_id,
+                'room_id': room_id,
                 'user_id': user_id,
                 'friend_user_id': current_user_id
             }, room=user_id)
 
-            return jsonify({'code': 0, 'msg': '好友请求已接受', 'room_id': room.room_id}), 200
+            return jsonify({'code': 0, 'msg': '好友请求已接受', 'room_id': room_id}), 200
         else:
             return jsonify({'code': 1, 'msg': '好友请求不存在'}), 404
     elif action == 'reject':
@@ -104,7 +108,8 @@ def handle_friend_request():
 def get_friend_requests():
     current_user_id = get_jwt_identity()
     requests = FriendRequest.query.filter_by(friend_id=current_user_id, status=0).all()
-    request_list = [{'user_id': req.user_id, 'username': User.find_by_id(req.user_id).username} for req in requests]
+    usernames = User.usernames([req.user_id for req in requests])
+    request_list = [{'user_id': req.user_id, 'username': usernames[req.user_id]} for req in requests]
     return jsonify({'code': 0, 'requests': request_list}), 200
 
 
@@ -113,34 +118,8 @@ def get_friend_requests():
 def get_friends():
     current_user_id = get_jwt_identity()
 
-    # 查询当前用户的所有好友关系
-    friendships = FriendRequest.query.filter(
-        or_(
-            FriendRequest.user_id == current_user_id,
-            FriendRequest.friend_id == current_user_id
-        ),
-        FriendRequest.status == 1  # 只获取已接受的好友关系
-    ).all()
-
-    # 处理查询结果
-    friend_list = []
-    for friendship in friendships:
-        # 确定好友的ID（不是当前用户的ID）
-        if friendship.user_id == current_user_id:
-            # 当前用户是发起方，好友是接收方
-            friend_id = friendship.friend_id
-        else:
-            # 当前用户是接收方，好友是发起方
-            friend_id = friendship.user_id
-
-        # 获取好友的用户信息
-        friend_user = User.find_by_id(friend_id)
-        if friend_user:
-            friend_list.append({
-                'user_id': friend_user.user_id,
-                'username': friend_user.username
-            })
-
+    # 好友集合与用户名一次往返取回
+    friend_list = friends_with_names(current_user_id)
     return jsonify({'code': 0, 'friends': friend_list}), 200
 
 @friends_bp.post('/delete_friend')
@@ -150,18 +129,11 @@ def delete_friend():
     friend_id = data.get('friend_id')
     current_user_id = get_jwt_identity()
 
-    # 查找好友关系（双向）
-    friendship = FriendRequest.query.filter(
-        or_(
-            (FriendRequest.user_id == current_user_id) & (FriendRequest.friend_id == friend_id),
-            (FriendRequest.user_id == friend_id) & (FriendRequest.friend_id == current_user_id)
-        ),
-        FriendRequest.status == 1  # 只删除已接受的好友关系
-    ).first()
+    if not friend_id:
+        return jsonify({'code': 1, 'msg': '好友ID不能为空'}), 400
 
-    if friendship:
-        db.session.delete(friendship)
-        db.session.commit()
+    if Friendship.remove(current_user_id, friend_id):
+        remove_friends(current_user_id, friend_id)
         return jsonify({'code': 0, 'msg': '好友删除成功'}), 200
     else:
         return jsonify({'code': 1, 'msg': '好友关系不存在'}), 404
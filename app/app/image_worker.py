@@ -0,0 +1,125 @@
+"""
+图片转码后台进程
+- 从 Redis 队列 upload:jobs 取任务，在独立进程中用 Pillow 转码，不占用 Web worker 的 gevent hub
+- 生成原图 / 中图 / 缩略图三种尺寸，各输出 JPEG 及 WebP（若 Pillow 支持）
+- 文件名为转码后原图 JPEG 的 SHA-256，相同内容只存一份，upload_file 表记录引用计数
+- 任务先移入本机的处理中列表，进程重启后重新入队，避免丢失
+- 完成后通过 Socket.IO 消息队列向上传者推送 upload_done / upload_failed
+运行：python -m app.image_worker
+"""
+import hashlib
+import io
+import json
+import logging
+import os
+import socket
+
+from flask_socketio import SocketIO
+from PIL import Image, features
+from sqlalchemy import create_engine
+
+from .models import UploadFile
+from .utils import init_redis, database_uri
+
+UPLOAD_DIR = os.path.join(os.path.dirname(__file__), 'upload')
+JOBS_KEY = 'upload:jobs'
+PROCESSING_KEY = f'upload:processing:{socket.gethostname()}'
+
+logger = logging.getLogger(__name__)
+
+
+# 尺寸名 -> (文件名后缀, 最长边像素)，原图不缩放、无后缀
+SIZES = {
+    'medium': ('_m', 960),
+    'thumb': ('_t', 240),
+}
+WEBP = features.check('webp')
+
+
+def variant_urls(url):
+    """返回各尺寸的访问地址，由 nginx 按 ?size= 选择对应文件"""
+    urls = {'original': url}
+    urls.update({size: f'{url}?size={size}' for size in SIZES})
+    return urls
+
+
+def _encode(img, fmt):
+    out = io.BytesIO()
+    if fmt == 'JPEG':
+        img.save(out, format='JPEG', quality=85, optimize=True)
+    else:
+        img.save(out, format='WEBP', quality=80, method=4)
+    return out.getvalue()
+
+
+def transcode(blob):
+    """转码为各尺寸的 JPEG 85%（及 WebP），返回 {文件名后缀: 内容}"""
+    img = Image.open(io.BytesIO(blob))
+    img = img.convert('RGB')
+    images = {'': img}
+    for suffix, edge in SIZES.values():
+        resized = img.copy()
+        resized.thumbnail((edge, edge), Image.LANCZOS)
+        images[suffix] = resized
+
+    outputs = {}
+    for suffix, variant in images.items():
+        outputs[f'{suffix}.jpg'] = _encode(variant, 'JPEG')
+        if WEBP:
+            outputs[f'{suffix}.webp'] = _encode(variant, 'WEBP')
+    return outputs
+
+
+def process(job, engine):
+    """转码并按内容哈希落盘，返回原图地址"""
+    with open(job['src'], 'rb') as fp:
+        outputs = transcode(fp.read())
+    content_hash = hashlib.sha256(outputs['.jpg']).hexdigest()
+    base = os.path.join(UPLOAD_DIR, content_hash)
+    # 相同内容已存在时不再重复写盘
+    if not os.path.exists(f'{base}.jpg'):
+        # 先写临时文件再原子重命名，nginx 不会读到半个文件；原图 JPEG 最后写入，作为全部完成的标志
+        for name in sorted(outputs, key=lambda name: name == '.jpg'):
+            tmp_path = f"{base}{name}.{job['job_id']}.part"
+            with open(tmp_path, 'wb') as fp:
+                fp.write(outputs[name])
+            os.replace(tmp_path, f'{base}{name}')
+    with engine.begin() as conn:
+        UploadFile.add_ref(conn, content_hash, 'jpg', job['source_hash'])
+    os.remove(job['src'])
+    return f'/upload/{content_hash}.jpg'
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    r = init_redis()
+    engine = create_engine(database_uri(), pool_pre_ping=True)
+    redis_url = os.getenv('REDIS_URL', 'redis://redis:6379/0')
+    emitter = SocketIO(message_queue=os.getenv('SOCKETIO_MESSAGE_QUEUE', redis_url),
+                       channel=os.getenv('SOCKETIO_CHANNEL', 'pychat-socketio'))
+
+    # 重新入队上次退出时未处理完的任务
+    while r.lmove(PROCESSING_KEY, JOBS_KEY, 'RIGHT', 'RIGHT'):
+        pass
+
+    while True:
+        raw = r.blmove(JOBS_KEY, PROCESSING_KEY, 0, 'RIGHT', 'LEFT')
+        job = json.loads(raw)
+        try:
+            url = process(job, engine)
+            emitter.emit('upload_done', {
+                'job_id': job['job_id'],
+                'url': url,
+                'variants': variant_urls(url)
+            }, room=job['user_id'], namespace='/')
+        except Exception as e:
+            logger.error(f"图片转码失败 {job['job_id']}: {str(e)}")
+            if os.path.exists(job['src']):
+                os.remove(job['src'])
+            emitter.emit('upload_failed', {'job_id': job['job_id'], 'msg': '图片处理失败'},
+                         room=job['user_id'], namespace='/')
+        r.lrem(PROCESSING_KEY, 1, raw)
+
+
+if __name__ == '__main__':
+    main()
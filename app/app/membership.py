@@ -0,0 +1,150 @@
+"""
+房间成员关系缓存
+- user:{id}:rooms 保存用户所在的房间集合，连接时据此加入房间，无需查库
+- room:{id}:members 保存房间成员集合，前面再加一层进程内缓存，用于发消息等操作的权限校验
+- 建群、私聊、加人、退群、通过好友请求时同步更新，移除成员时通知所有 worker 失效本地缓存
+- 缓存缺失时从数据库加载并回填；每个集合带版本号，成员变更时递增，加载期间版本变化则放弃回填
+"""
+import redis
+
+from .cache import LRUCache, MISSING, listen_invalidations
+from .models import db, RoomMember
+from .utils import init_redis
+
+r = init_redis()
+
+LOADED = '-'       # 占位成员，用于区分"未加载"与"集合为空"
+CACHE_TTL = 3600   # 兜底过期时间，限制异常情况下的不一致窗口
+INVALIDATE_CHANNEL = 'cache:invalidate:room_members'
+
+# room_id -> 成员 user_id 集合
+_local_members = LRUCache(maxsize=5000, ttl=30)
+
+# 只更新已加载的集合，未加载的集合下次读取时会从数据库完整加载
+_sadd_if_exists = r.register_script("""
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    redis.call('SADD', KEYS[1], ARGV[1])
+end
+return 0
+""")
+
+# 版本号与读库前一致才回填，否则读到的可能是成员变更之前的快照
+# KEYS: 集合, 版本号   ARGV: 读库前的版本号, 过期时间, 成员...
+_fill_if_unchanged = r.register_script("""
+if (redis.call('GET', KEYS[2]) or '0') ~= ARGV[1] then
+    return 0
+end
+for i = 3, #ARGV, 1000 do
+    redis.call('SADD', KEYS[1], unpack(ARGV, i, math.min(i + 999, #ARGV)))
+end
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+return 1
+""")
+
+
+def user_rooms_key(user_id):
+    return f'user:{user_id}:rooms'
+
+
+def room_members_key(room_id):
+    return f'room:{room_id}:members'
+
+
+def version_key(key):
+    return f'{key}:ver'
+
+
+def _bump(pipe, key):
+    pipe.incr(version_key(key))
+    pipe.expire(version_key(key), CACHE_TTL)
+
+
+def _load_set(key, query, cached=None):
+    # 读取缓存集合（调用方已预取时直接使用），缺失时执行 query 从数据库加载并回填
+    if cached is None:
+        try:
+            cached = r.smembers(key)
+        except redis.RedisError:
+            cached = None
+    if cached:
+        return {value for value in cached if value != LOADED}
+
+    # 版本号必须在查库之前读取
+    try:
+        version = r.get(version_key(key)) or '0'
+    except redis.RedisError:
+        version = None
+    values = {str(value) for (value,) in query}
+    if version is not None:
+        try:
+            _fill_if_unchanged(keys=[key, version_key(key)], args=[version, CACHE_TTL, LOADED, *values])
+        except redis.RedisError:
+            pass
+    return values
+
+
+def rooms_of(user_id, cached=None):
+    """返回用户所在的房间 ID 集合；cached 为已预取的 user:{id}:rooms 成员"""
+    return {int(room_id) for room_id in _load_set(
+        user_rooms_key(user_id),
+        db.session.query(RoomMember.room_id).filter(RoomMember.user_id == user_id),
+        cached
+    )}
+
+
+def members_of(room_id):
+    """返回房间成员的 user_id 集合"""
+    return _load_set(
+        room_members_key(room_id),
+        db.session.query(RoomMember.user_id).filter(RoomMember.room_id == room_id)
+    )
+
+
+def is_member(room_id, user_id):
+    """校验用户是否在房间中：先查进程内缓存，未命中再查 Redis / 数据库"""
+    key = str(room_id)
+    members = _local_members.get(key)
+    if members is not MISSING and user_id in members:
+        return True
+    # 本地未命中或可能是刚加入的成员，回源确认
+    members = members_of(room_id)
+    _local_members.set(key, members)
+    return user_id in members
+
+
+def add_members(room_id, user_ids):
+    """成员关系已提交到数据库后调用"""
+    try:
+        pipe = r.pipeline(transaction=False)
+        for user_id in user_ids:
+            _sadd_if_exists(keys=[user_rooms_key(user_id)], args=[room_id], client=pipe)
+            _sadd_if_exists(keys=[room_members_key(room_id)], args=[user_id], client=pipe)
+            _bump(pipe, user_rooms_key(user_id))
+        _bump(pipe, room_members_key(room_id))
+        pipe.execute()
+    except redis.RedisError:
+        pass
+
+
+def remove_member(room_id, user_id):
+    remove_members(room_id, [user_id])
+
+
+def remove_members(room_id, user_ids):
+    """成员关系已从数据库删除后调用"""
+    _local_members.pop(str(room_id))
+    try:
+        pipe = r.pipeline()
+        for user_id in user_ids:
+            pipe.srem(user_rooms_key(user_id), room_id)
+            _bump(pipe, user_rooms_key(user_id))
+        pipe.srem(room_members_key(room_id), *user_ids)
+        _bump(pipe, room_members_key(room_id))
+        pipe.publish(INVALIDATE_CHANNEL, str(room_id))
+        pipe.execute()
+    except redis.RedisError:
+        pass
+
+
+def listen():
+    listen_invalidations(INVALIDATE_CHANNEL, _local_members)
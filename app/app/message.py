@@ -1,49 +1,107 @@
 """
-历史消息分页 + WebSocket 收发
-- Redis 统计在线人数
+历史消息游标分页 + WebSocket 收发
+- Redis 维护按用户计数的在线状态
 - 消息持久化
 - 支持房间聊天功能
 """
-from datetime import datetime
+import time
+from functools import wraps
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity, decode_token
 from flask_socketio import emit, disconnect, join_room, leave_room
-from .models import db, Message, Room, RoomMember, User
-from .utils import init_redis
+from .models import Message, User
 from .extensions import socketio
+from . import presence
+from .membership import is_member
+from .receipts import record_receipt
+from .revocation import is_revoked
+from .search import index_message
+from .summary import update_summary
+from .typing_status import should_accept, set_typing, forget
+from .utils import encode_cursor, decode_cursor
+from .writer import save_message
 
 msg_bp = Blueprint('msg', __name__, url_prefix='')
-r = init_redis()
+
+# sid -> 连接时校验过的 Token 信息，事件处理时不再重复验签
+_socket_identities = {}
+REVALIDATE_INTERVAL = 30  # 吊销状态的复查间隔（秒）
+
+def socket_auth_required(fn):
+    """Socket 事件鉴权：使用连接时绑定的身份，Token 过期或被吊销时断开连接"""
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        identity = _socket_identities.get(request.sid)
+        now = time.time()
+        if not identity or identity['exp'] <= now:
+            disconnect()
+            return
+        if now - identity['checked_at'] > REVALIDATE_INTERVAL:
+            if is_revoked(identity['jti']):
+                disconnect()
+                return
+            identity['checked_at'] = now
+        return fn(*args, **kwargs)
+    return wrapper
+
+def socket_user_id():
+    return _socket_identities[request.sid]['user_id']
+
+def is_int_id(value):
+    """客户端传来的 ID 必须是 JSON 整数：True、1.0 在 SQL 中都等于 1，会被当作房间 1 通过成员校验"""
+    return type(value) is int
 
 @msg_bp.get('/history')
 @jwt_required()
 def history():
-    page = int(request.args.get('page', 1))
     size = 50
-    data = Message.get_page(page, size)
-    return {'data': data, 'has_more': len(data) == size}
+    before_msg_id = request.args.get('before_msg_id', type=int)
+    cursor = request.args.get('cursor')
+    if cursor:
+        position = decode_cursor(cursor)
+        if position is None:
+            return jsonify({'code': 1, 'msg': '无效的游标'}), 400
+        before_msg_id = position.get('before_msg_id')
+
+    data = Message.get_page(size, before_msg_id)
+    has_more = len(data) == size
+    next_cursor = encode_cursor(before_msg_id=data[-1]['msg_id']) if has_more else None
+    return {'data': data, 'has_more': has_more, 'next_cursor': next_cursor}
 
 @msg_bp.get('/room_history')
 @jwt_required()
 def room_history():
     room_id = request.args.get('room_id', 0, type=int)
-    page = request.args.get('page', 1, type=int)
-    size = request.args.get('size', 50, type=int)
+    size = max(1, min(request.args.get('size', 50, type=int), 200))
+    before_seq = request.args.get('before_seq', type=int)
+    after_seq = request.args.get('after_seq', type=int)
+    cursor = request.args.get('cursor')
+    if cursor:
+        position = decode_cursor(cursor)
+        if position is None:
+            return jsonify({'code': 1, 'msg': '无效的游标'}), 400
+        before_seq, after_seq = position.get('before_seq'), position.get('after_seq')
 
     # 检查用户是否在房间中
     current_user_id = get_jwt_identity()
     if room_id != 0:
-        membership = RoomMember.query.filter_by(room_id=room_id, user_id=current_user_id).first()
-        if not membership:
+        if not is_member(room_id, current_user_id):
             return jsonify({'code': 1, 'msg': '您不在该房间中'}), 403
 
-    messages = Message.get_messages_for_room(room_id, page, size)
+    messages = Message.get_messages_for_room(room_id, size, before_seq=before_seq, after_seq=after_seq)
     data = [{'sender_id': msg['sender'], 'sender': msg['username'], 'body': msg['body'], 'ts': msg['ts'], 'seq': msg['seq']} for msg in messages]
 
     if not data:
-        return jsonify({'code': 0, 'data': [], 'has_more': False}), 200
+        return jsonify({'code': 0, 'data': [], 'has_more': False, 'next_cursor': None}), 200
 
-    return jsonify({'code': 0, 'data': data, 'has_more': len(data) == size}), 200
+    # 向前翻页时游标指向本页最早一条，否则指向本页最新一条
+    has_more = len(data) == size
+    if before_seq is not None:
+        next_cursor = encode_cursor(before_seq=data[0]['seq'])
+    else:
+        next_cursor = encode_cursor(after_seq=data[-1]['seq'])
+    return jsonify({'code': 0, 'data': data, 'has_more': has_more,
+                    'next_cursor': next_cursor if has_more else None}), 200
 
 @socketio.on('connect')
 def on_connect():
@@ -54,24 +112,31 @@ def on_connect():
             disconnect()
             return False
 
-        # 手动验证token
+        # 手动验证token（签名、有效期、是否已吊销），后续事件复用校验结果
         decoded_token = decode_token(token)
+        if is_revoked(decoded_token['jti']):
+            disconnect()
+            return False
         current_user = decoded_token['sub']
+        _socket_identities[request.sid] = {
+            'user_id': current_user,
+            'jti': decoded_token['jti'],
+            'exp': decoded_token['exp'],
+            'checked_at': time.time()
+        }
 
-        # 存储用户ID和sessionID的映射
-        r.sadd('online', request.sid)
-        r.set(f'session:{request.sid}', current_user)
-        r.set(f'user:{current_user}:session', request.sid)
+        # 登记在线状态（上线通知由后台按周期合并推送），同一次往返取回用户所在房间
+        room_ids = presence.connect(request.sid, current_user)
 
         # 让用户加入其所在的所有房间
-        memberships = RoomMember.query.filter_by(user_id=current_user).all()
-        for membership in memberships:
-            join_room(str(membership.room_id))
+        for room_id in room_ids:
+            join_room(str(room_id))
 
         # 加入全局房间
         join_room('0')
 
-        emit('online', {'count': r.scard('online')}, broadcast=True)
+        # 加入以用户ID命名的个人房间，用于好友请求、新群聊等定向通知
+        join_room(current_user)
         print(f'[WS] 用户 {current_user} 已连接')
     except Exception as e:
         print(f'[WS] 连接失败: {str(e)}')
@@ -81,114 +146,96 @@ def on_connect():
 @socketio.on('disconnect')
 def on_disconnect():
     session_id = request.sid
-    user_id = r.get(f'session:{session_id}')
-    if user_id:
-        r.delete(f'session:{session_id}')
-        r.delete(f'user:{user_id}:session')
-    r.srem('online', session_id)
-    emit('online', {'count': r.scard('online')}, broadcast=True)
+    user_id = presence.disconnect(session_id)
+    forget(session_id)
+    _socket_identities.pop(session_id, None)
     print(f'[WS] 用户 {user_id} 已断开连接')
 
 @socketio.on('join_room')
-@jwt_required()
+@socket_auth_required
 def on_join_room(data):
     room_id = data.get('room_id')
-    user_id = get_jwt_identity()
+    user_id = socket_user_id()
 
     # 检查用户是否在房间中
-    membership = RoomMember.query.filter_by(room_id=room_id, user_id=user_id).first()
-    if not membership and room_id != 0:  # 全局房间不需要检查
+    if room_id != 0 and not is_member(room_id, user_id):  # 全局房间不需要检查
         return
 
     join_room(str(room_id))
     print(f'[WS] 用户 {user_id} 加入房间 {room_id}')
 
 @socketio.on('leave_room')
-@jwt_required()
+@socket_auth_required
 def on_leave_room(data):
     room_id = data.get('room_id')
-    user_id = get_jwt_identity()
+    user_id = socket_user_id()
 
     leave_room(str(room_id))
     print(f'[WS] 用户 {user_id} 离开房间 {room_id}')
 
 @socketio.on('chat')
-@jwt_required()
+@socket_auth_required
 def on_chat(json):
-    user_id = get_jwt_identity()
+    user_id = socket_user_id()
     body = str(json.get('body', ''))[:2000]
     room_id = json.get('room_id', 0)  # 默认为全局房间
+    if not is_int_id(room_id):
+        return
 
     # 检查用户是否在房间中
     if room_id != 0:
-        membership = RoomMember.query.filter_by(room_id=room_id, user_id=user_id).first()
-        if not membership:
+        if not is_member(room_id, user_id):
             return jsonify({'code': 1, 'msg': '您不在该房间中'}), 403
 
-    # 保存消息
-    Message.save(user_id, body, room_id)
+    # 保存消息（开启 write-behind 时仅入缓冲队列，由后台批量落库）
+    seq, ts = save_message(user_id, body, room_id)
+
+    # 增量更新全文搜索的倒排索引
+    index_message(room_id, seq, body, ts)
 
     # 获取发送者用户名
-    user = User.find_by_id(user_id)
-    username = user.username if user else user_id
+    username = User.get_username(user_id) or user_id
 
     # 发送消息到房间
     emit('chat', {
         'sender_id': user_id,
         'sender': username,
         'body': body,
-        'ts': datetime.utcnow().isoformat(),
-        'room_id': room_id
+        'ts': ts.isoformat(),
+        'room_id': room_id,
+        'seq': seq
     }, room=str(room_id))  # 使用房间ID作为房间名
 
+    # 推进房间摘要；chat 事件已带 room_id、seq 与消息内容，客户端据此更新会话列表的未读角标，不再单独推送摘要
+    update_summary(room_id, seq, user_id, username, body, ts.isoformat())
+
 @socketio.on('typing')
-@jwt_required()
+@socket_auth_required
 def on_typing(json):
-    user_id = get_jwt_identity()
     room_id = json.get('room_id', 0)
-    is_typing = json.get('is_typing', False)
+    is_typing = bool(json.get('is_typing', False))
+    if not isinstance(room_id, int):
+        return
 
-    # 获取发送者用户名
-    user = User.find_by_id(user_id)
-    username = user.username if user else user_id
+    # 同一连接重复上报相同状态时直接丢弃
+    if not should_accept(request.sid, room_id, is_typing):
+        return
 
-    # 发送输入状态到房间
-    emit('typing', {
-        'user_id': user_id,
-        'username': username,
-        'is_typing': is_typing
-    }, room=str(room_id), include_self=False)
+    # 只记录房间成员的输入状态，由后台按周期聚合成"谁在输入"快照广播到房间
+    user_id = socket_user_id()
+    if room_id != 0 and not is_member(room_id, user_id):
+        return
+    set_typing(room_id, user_id, is_typing)
 
 @socketio.on('read_receipt')
-@jwt_required()
+@socket_auth_required
 def on_read_receipt(json):
-    user_id = get_jwt_identity()
+    user_id = socket_user_id()
     room_id = json.get('room_id', 0)
     last_read_seq = json.get('last_read_seq', 0)
+    if not is_int_id(room_id) or room_id == 0 or not is_int_id(last_read_seq):
+        return
 
-    # 更新用户在该房间的最后阅读位置
-    if room_id != 0:
-        membership = RoomMember.query.filter_by(room_id=room_id, user_id=user_id).first()
-        if membership:
-            membership.last_read_seq = last_read_seq
-            db.session.commit()
-
-            # 发送已读回执到房间
-            emit('read_receipt', {
-                'user_id': user_id,
-                'room_id': room_id,
-                'last_read_seq': last_read_seq
-            }, room=str(room_id))
-
-@socketio.on('new_private_chat')
-def handle_new_private_chat(data):
-    room_id = data['room_id']
-    user_id = data['user_id']
-    friend_user_id = data['friend_user_id']
-
-    # 通知用户有新的私聊房间
-    emit('new_private_chat', {
-        'room_id': room_id,
-        'friend_user_id': friend_user_id
-    }, room=user_id)
-
+    # 更新用户在该房间的最后阅读位置：只记录最大值，由后台定时批量落库并聚合广播
+    if is_member(room_id, user_id):
+        record_receipt(room_id, user_id, last_read_seq)
@@ -5,12 +5,27 @@ import hashlib
 import os
 import uuid
 from datetime import datetime
+import redis
+from flask import g
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import or_, cast, Integer
+from sqlalchemy import or_, cast, Integer, text
+from sqlalchemy.exc import IntegrityError
 
+from .cache import ProfileCache
 from .extensions import db
+from .utils import init_redis
 import bcrypt
 
+r = init_redis()
+
+# 仅当计数键已存在时才 INCR，避免在未初始化时从 0 开始分配
+_incr_if_exists = r.register_script("""
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return redis.call('INCR', KEYS[1])
+end
+return false
+""")
+
 class User(db.Model):
     __tablename__ = 'user'
     user_id = db.Column(db.String(8), primary_key=True)
@@ -26,6 +41,29 @@ class User(db.Model):
     def find_by_id(user_id):
         return User.query.filter_by(user_id=user_id).first()
 
+    @staticmethod
+    def usernames(user_ids):
+        """
+        批量获取 user_id -> username，一次 IN 查询补齐缺失项
+        结果缓存在本次请求的 identity map（flask.g）中，供其他序列化逻辑复用
+        """
+        identity_map = g.setdefault('usernames', {})
+        missing = [uid for uid in set(user_ids) if uid not in identity_map]
+        if missing:
+            # 依次查询进程内缓存、Redis，最后批量回源数据库
+            for uid, profile in user_profiles.get_many(missing).items():
+                identity_map[uid] = profile['username'] if profile else None
+        return {uid: identity_map[uid] for uid in user_ids}
+
+    @staticmethod
+    def get_username(user_id):
+        return User.usernames([user_id])[user_id]
+
+    @staticmethod
+    def load_profiles(user_ids):
+        rows = db.session.query(User.user_id, User.username).filter(User.user_id.in_(user_ids)).all()
+        return {user_id: {'username': username} for user_id, username in rows}
+
     @staticmethod
     def create(username, plain_pwd, user_id):
         # 确保密码长度在 8-12 位之间
@@ -74,8 +112,16 @@ class User(db.Model):
             return '10000001'
         return str(int(max_user_id) + 1).zfill(8)
 
+# user_id -> {username} 两级缓存，用户名变更时通过 invalidate 通知所有 worker
+user_profiles = ProfileCache('user', User.load_profiles)
+
+
 class FriendRequest(db.Model):
     __tablename__ = 'friend'
+    __table_args__ = (
+        db.Index('idx_friend_pair', 'user_id', 'friend_id', 'status'),
+        db.Index('idx_friend_target', 'friend_id', 'status'),
+    )
     id = db.Column(db.BigInteger, primary_key=True)
     user_id = db.Column(db.String(8), db.ForeignKey('user.user_id'))
     friend_id = db.Column(db.String(8), db.ForeignKey('user.user_id'))
@@ -98,16 +144,6 @@ class FriendRequest(db.Model):
             FriendRequest.status == 0
         ).first() is not None
 
-    @staticmethod
-    def is_friend(user_id, friend_id):
-        return FriendRequest.query.filter(
-            or_(
-                (FriendRequest.user_id == user_id) & (FriendRequest.friend_id == friend_id),
-                (FriendRequest.user_id == friend_id) & (FriendRequest.friend_id == user_id)
-            ),
-            FriendRequest.status == 1
-        ).first() is not None
-
     @staticmethod
     def accept_request(user_id, friend_id):
         request = FriendRequest.query.filter(
@@ -119,6 +155,8 @@ class FriendRequest(db.Model):
         ).first()
         if request:
             request.status = 1
+            # 好友关系与申请状态在同一事务内写入
+            Friendship.add(user_id, friend_id)
             db.session.commit()
             return True
         return False
@@ -139,6 +177,54 @@ class FriendRequest(db.Model):
         return False
 
 
+class Friendship(db.Model):
+    """已确立的好友关系，每对用户按 (较小 ID, 较大 ID) 只存一行"""
+    __tablename__ = 'friendship'
+    __table_args__ = (db.Index('idx_friendship_b', 'user_b', 'user_a'),)
+    user_a = db.Column(db.String(8), db.ForeignKey('user.user_id'), primary_key=True)
+    user_b = db.Column(db.String(8), db.ForeignKey('user.user_id'), primary_key=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    @staticmethod
+    def pair(user_id, friend_id):
+        return (user_id, friend_id) if user_id < friend_id else (friend_id, user_id)
+
+    @staticmethod
+    def add(user_id, friend_id):
+        # 不提交，由调用方与其他写操作一起提交；已存在时忽略
+        user_a, user_b = Friendship.pair(user_id, friend_id)
+        db.session.execute(text(
+            "INSERT IGNORE INTO friendship (user_a, user_b, created_at) VALUES (:user_a, :user_b, NOW())"
+        ), {'user_a': user_a, 'user_b': user_b})
+
+    @staticmethod
+    def remove(user_id, friend_id):
+        """删除好友关系及对应的已接受申请，返回是否存在该关系"""
+        user_a, user_b = Friendship.pair(user_id, friend_id)
+        deleted = Friendship.query.filter_by(user_a=user_a, user_b=user_b).delete()
+        FriendRequest.query.filter(
+            or_(
+                (FriendRequest.user_id == user_id) & (FriendRequest.friend_id == friend_id),
+                (FriendRequest.user_id == friend_id) & (FriendRequest.friend_id == user_id)
+            ),
+            FriendRequest.status == 1
+        ).delete(synchronize_session=False)
+        db.session.commit()
+        return deleted > 0
+
+    @staticmethod
+    def exists(user_id, friend_id):
+        user_a, user_b = Friendship.pair(user_id, friend_id)
+        return db.session.query(Friendship.query.filter_by(user_a=user_a, user_b=user_b).exists()).scalar()
+
+    @staticmethod
+    def friend_ids_query(user_id):
+        # 两个方向各走一个索引
+        return db.session.query(Friendship.user_b).filter(Friendship.user_a == user_id).union_all(
+            db.session.query(Friendship.user_a).filter(Friendship.user_b == user_id)
+        )
+
+
 # 在 Room 模型中添加关系
 class Room(db.Model):
     __tablename__ = 'room'
@@ -146,15 +232,56 @@ class Room(db.Model):
     group_flag = db.Column(db.Boolean, default=False)
     name = db.Column(db.String(255))
     owner = db.Column(db.String(8), db.ForeignKey('user.user_id'))
+    # 私聊双方按 "较小ID:较大ID" 拼接，唯一索引保证每对用户只有一个私聊；群聊为 NULL
+    dm_key = db.Column(db.String(17), unique=True)
 
     # 添加关系
     members = db.relationship('RoomMember', backref='room', lazy=True)
     messages = db.relationship('Message', backref='room_ref', lazy=True)
 
+    @staticmethod
+    def get_or_create_private(user_id, friend_id):
+        """
+        返回 (room_id, 是否新建)；已存在时只需一次唯一索引查询
+        并发创建时由唯一索引兜底，冲突的一方回滚后读取对方创建的房间
+        复用已有房间时补回退出过私聊的一方，调用方需随后更新成员缓存
+        """
+        dm_key = ':'.join(Friendship.pair(user_id, friend_id))
+        room_id = db.session.query(Room.room_id).filter_by(dm_key=dm_key).scalar()
+        if room_id:
+            Room._ensure_private_members(room_id, user_id, friend_id)
+            return room_id, False
+
+        room = Room(group_flag=False, name=None, owner=None, dm_key=dm_key)
+        db.session.add(room)
+        try:
+            db.session.flush()  # 获取room_id但不提交
+            db.session.add_all([
+                RoomMember(room_id=room.room_id, user_id=user_id, last_read_seq=0),
+                RoomMember(room_id=room.room_id, user_id=friend_id, last_read_seq=0)
+            ])
+            db.session.commit()
+            return room.room_id, True
+        except IntegrityError:
+            db.session.rollback()
+            room_id = db.session.query(Room.room_id).filter_by(dm_key=dm_key).scalar()
+            Room._ensure_private_members(room_id, user_id, friend_id)
+            return room_id, False
+
+    @staticmethod
+    def _ensure_private_members(room_id, user_id, friend_id):
+        # 已在房间中的成员由唯一索引忽略
+        db.session.execute(RoomMember.__table__.insert().prefix_with('IGNORE'), [
+            {'room_id': room_id, 'user_id': user_id, 'last_read_seq': 0},
+            {'room_id': room_id, 'user_id': friend_id, 'last_read_seq': 0}
+        ])
+        db.session.commit()
+
 
 # 在 RoomMember 模型中添加关系
 class RoomMember(db.Model):
     __tablename__ = 'room_member'
+    __table_args__ = (db.UniqueConstraint('room_id', 'user_id', name='uk_room_member'),)
     id = db.Column(db.BigInteger, primary_key=True, autoincrement=True)
     room_id = db.Column(db.BigInteger, db.ForeignKey('room.room_id'))
     user_id = db.Column(db.String(8), db.ForeignKey('user.user_id'))
@@ -164,10 +291,58 @@ class RoomMember(db.Model):
     user = db.relationship('User', backref='room_memberships', lazy=True)
 
 
+class RoomSeq(db.Model):
+    """
+    房间消息序号分配器
+    - 主路径：Redis INCR，按房间原子递增，首次使用时从 message 表惰性初始化
+    - 降级路径：Redis 不可用时使用 room_seq 计数表，行锁保证并发安全
+    """
+    __tablename__ = 'room_seq'
+    room_id = db.Column(db.BigInteger, primary_key=True)
+    seq = db.Column(db.BigInteger, nullable=False, default=0)
+
+    @staticmethod
+    def key(room_id):
+        return f'room:{room_id}:seq'
+
+    @staticmethod
+    def allocate(room_id):
+        key = RoomSeq.key(room_id)
+        try:
+            for _ in range(3):
+                seq = _incr_if_exists(keys=[key])
+                if seq is not None:
+                    return int(seq)
+                # 计数键不存在，用数据库中的最大序号初始化（NX 保证只有一个进程生效）
+                r.set(key, Message.max_seq(room_id), nx=True)
+        except redis.RedisError:
+            pass
+        return RoomSeq.allocate_from_db(room_id)
+
+    @staticmethod
+    def allocate_from_db(room_id):
+        # 计数行不存在则插入，存在则递增；GREATEST 保证不落后于已写入的消息
+        floor = Message.max_seq(room_id)
+        db.session.execute(text(
+            "INSERT INTO room_seq (room_id, seq) VALUES (:room_id, LAST_INSERT_ID(:floor + 1)) "
+            "ON DUPLICATE KEY UPDATE seq = LAST_INSERT_ID(GREATEST(seq, :floor) + 1)"
+        ), {'room_id': room_id, 'floor': floor})
+        return int(db.session.execute(text("SELECT LAST_INSERT_ID()")).scalar())
+
+    @staticmethod
+    def reset(room_id):
+        # 删除 Redis 计数键，下次分配时重新从数据库初始化
+        try:
+            r.delete(RoomSeq.key(room_id))
+        except redis.RedisError:
+            pass
+
+
 # 在 models.py 中的 Message 类
 
 class Message(db.Model):
     __tablename__ = 'message'
+    __table_args__ = (db.UniqueConstraint('room_id', 'seq', name='uk_message_room_seq'),)
     msg_id = db.Column(db.BigInteger, primary_key=True, autoincrement=True)
     room_id = db.Column(db.BigInteger, db.ForeignKey('room.room_id'), default=0)
     seq = db.Column(db.BigInteger, default=0)
@@ -180,35 +355,98 @@ class Message(db.Model):
     # 添加关系
     sender_ref = db.relationship('User', backref='messages', lazy=True)
 
+    @staticmethod
+    def max_seq(room_id):
+        # 走 (room_id, seq) 唯一索引，无需全表扫描
+        return db.session.query(db.func.max(Message.seq)).filter_by(room_id=room_id).scalar() or 0
+
     @staticmethod
     def save(sender, body, room_id=0, type=0, status=0):
-        # 获取当前房间的最后一个 seq 值
-        last_seq = db.session.query(db.func.max(Message.seq)).filter_by(room_id=room_id).scalar() or 0
-        seq = last_seq + 1
-        msg = Message(sender=sender, body=body, room_id=room_id, seq=seq, type=type, status=status)
-        db.session.add(msg)
-        db.session.commit()
+        # 由 RoomSeq 原子分配序号，返回本条消息的 seq
+        for attempt in range(2):
+            seq = RoomSeq.allocate(room_id)
+            msg = Message(sender=sender, body=body, room_id=room_id, seq=seq, type=type, status=status)
+            db.session.add(msg)
+            try:
+                db.session.commit()
+                return seq
+            except IntegrityError:
+                # (room_id, seq) 冲突说明 Redis 计数落后（例如曾降级到计数表），重置后重试一次
+                db.session.rollback()
+                if attempt:
+                    raise
+                RoomSeq.reset(room_id)
 
     @staticmethod
-    def get_page(page, size):
-        msgs = (Message.query.order_by(Message.msg_id.desc())
-                .limit(size)
-                .offset((page - 1) * size)
-                .all())
+    def get_page(size, before_msg_id=None):
+        # 基于 msg_id 主键的游标分页，按时间倒序
+        query = Message.query
+        if before_msg_id is not None:
+            query = query.filter(Message.msg_id < before_msg_id)
+        msgs = query.order_by(Message.msg_id.desc()).limit(size).all()
         return [{'sender': m.sender,
                  'body': m.body,
                  'ts': m.ts.isoformat(),
                  'msg_id': m.msg_id} for m in msgs]
 
     @staticmethod
-    def get_messages_for_room(room_id, page, size):
-        msgs = (Message.query.filter_by(room_id=room_id)
-                .order_by(Message.seq.asc())
-                .limit(size)
-                .offset((page - 1) * size)
-                .all())
+    def get_messages_for_room(room_id, size, before_seq=None, after_seq=None):
+        # 基于 (room_id, seq) 索引的游标分页，结果均按 seq 升序返回
+        query = Message.query.filter_by(room_id=room_id)
+        if before_seq is not None:
+            msgs = (query.filter(Message.seq < before_seq)
+                    .order_by(Message.seq.desc())
+                    .limit(size)
+                    .all())
+            msgs.reverse()
+        else:
+            msgs = (query.filter(Message.seq > (after_seq or 0))
+                    .order_by(Message.seq.asc())
+                    .limit(size)
+                    .all())
+        # 一次查询取回本页所有发送者的用户名
+        usernames = User.usernames({m.sender for m in msgs})
         return [{'sender': m.sender,
-                 'username': (User.find_by_id(m.sender)).username,  # 包含用户名
+                 'username': usernames[m.sender],  # 包含用户名
                  'body': m.body,
                  'ts': m.ts.isoformat(),
-                 'seq': m.seq} for m in msgs]
\ No newline at end of file
+                 'seq': m.seq} for m in msgs]
+
+
+
+class UploadFile(db.Model):
+    """按内容哈希（转码后输出的 SHA-256）存储的上传文件，ref_count 为被上传引用的次数"""
+    __tablename__ = 'upload_file'
+    content_hash = db.Column(db.String(64), primary_key=True)
+    ext = db.Column(db.String(8), nullable=False)
+    ref_count = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    @property
+    def url(self):
+        return f'/upload/{self.content_hash}.{self.ext}'
+
+    @staticmethod
+    def add_ref(conn, content_hash, ext, source_hash):
+        """
+        登记一次引用，并记录原始内容哈希到输出的映射
+        conn 可以是 db.session，也可以是转码进程中的 SQLAlchemy 连接
+        """
+        conn.execute(text(
+            "INSERT INTO upload_file (content_hash, ext, ref_count, created_at) "
+            "VALUES (:content_hash, :ext, 1, NOW()) "
+            "ON DUPLICATE KEY UPDATE ref_count = ref_count + 1"
+        ), {'content_hash': content_hash, 'ext': ext})
+        conn.execute(text(
+            "INSERT IGNORE INTO upload_source (source_hash, content_hash) "
+            "VALUES (:source_hash, :content_hash)"
+        ), {'source_hash': source_hash, 'content_hash': content_hash})
+
+
+class UploadSource(db.Model):
+    """原始上传内容的 SHA-256 -> 转码后的内容哈希，重复上传时据此跳过转码"""
+    __tablename__ = 'upload_source'
+    source_hash = db.Column(db.String(64), primary_key=True)
+    content_hash = db.Column(db.String(64), db.ForeignKey('upload_file.content_hash'), nullable=False)
+
+    file = db.relationship('UploadFile', lazy='joined')
@@ -0,0 +1,179 @@
+"""
+用户名 / 群名搜索索引
+- 名称转小写后按单字及相邻两字（bigram）切分，每个片段一个有序集合 nameidx:{kind}:{gram}
+  成员为 user_id / room_id，分数为名称长度，短名称优先
+- nameidx:{kind}:names 保存 ID -> 名称，查询时一次往返取回候选及名称
+- 注册、改名、建群时增量更新，群解散时移除；已有数据通过 python -m app.name_index rebuild 重建
+- 查询由 Lua 脚本从最短的片段集合出发求交，候选数有上限，再按匹配程度排序分页
+"""
+import sys
+
+from sqlalchemy import create_engine, select
+
+from .models import User, Room
+from .utils import init_redis, redis_timer, database_uri
+
+r = init_redis()
+
+USER = 'user'
+GROUP = 'group'
+MAX_QUERY_GRAMS = 8
+CANDIDATE_LIMIT = 200  # 单次查询最多取回的候选数，分页也只在这个范围内进行
+
+# KEYS: 各片段集合..., 名称表
+# ARGV: 候选上限
+# 返回扁平数组 {id, name, ...}
+_lookup = r.register_script("""
+local names_key = KEYS[#KEYS]
+local ngram = #KEYS - 1
+local shortest, shortest_card = 1, nil
+for j = 1, ngram do
+    local card = redis.call('ZCARD', KEYS[j])
+    if card == 0 then return {} end
+    if shortest_card == nil or card < shortest_card then
+        shortest, shortest_card = j, card
+    end
+end
+local limit = tonumber(ARGV[1])
+local ids = {}
+local offset = 0
+while #ids < limit do
+    local batch = redis.call('ZRANGE', KEYS[shortest], offset, offset + limit - 1)
+    if #batch == 0 then break end
+    for _, id in ipairs(batch) do
+        local hit = true
+        for j = 1, ngram do
+            if j ~= shortest and not redis.call('ZSCORE', KEYS[j], id) then
+                hit = false
+                break
+            end
+        end
+        if hit then
+            table.insert(ids, id)
+            if #ids >= limit then break end
+        end
+    end
+    offset = offset + limit
+    -- 最多扫描 10 批，保证单次查询耗时有上限
+    if offset >= limit * 10 then break end
+end
+if #ids == 0 then return {} end
+local names = redis.call('HMGET', names_key, unpack(ids))
+local out = {}
+for i, id in ipairs(ids) do
+    if names[i] then
+        table.insert(out, id)
+        table.insert(out, names[i])
+    end
+end
+return out
+""")
+
+
+def grams(name, for_query=False):
+    """单字 + bigram；查询时只有一个字的才用单字"""
+    text = ''.join(name.lower().split())
+    bigrams = [text[i:i + 2] for i in range(len(text) - 1)]
+    if for_query:
+        return list(dict.fromkeys(bigrams or list(text)))[:MAX_QUERY_GRAMS]
+    return list(dict.fromkeys(list(text) + bigrams))
+
+
+def gram_key(kind, gram):
+    return f'nameidx:{kind}:{gram}'
+
+
+def names_key(kind):
+    return f'nameidx:{kind}:names'
+
+
+def index_name(kind, entity_id, name, old_name=None, client=None):
+    """写入（或在改名时替换）一个名称的索引，一次往返完成"""
+    pipe = client or r.pipeline(transaction=False)
+    entity_id = str(entity_id)
+    new_grams = set(grams(name))
+    if old_name:
+        for gram in set(grams(old_name)) - new_grams:
+            pipe.zrem(gram_key(kind, gram), entity_id)
+    for gram in new_grams:
+        pipe.zadd(gram_key(kind, gram), {entity_id: len(name)})
+    pipe.hset(names_key(kind), entity_id, name)
+    if client is None:
+        with redis_timer('name_index.update'):
+            pipe.execute()
+
+
+def remove(kind, entity_id, name=None):
+    """移除一个名称的全部索引；name 缺省时从名称表读取"""
+    entity_id = str(entity_id)
+    if name is None:
+        name = r.hget(names_key(kind), entity_id)
+    pipe = r.pipeline(transaction=False)
+    for gram in grams(name or ''):
+        pipe.zrem(gram_key(kind, gram), entity_id)
+    pipe.hdel(names_key(kind), entity_id)
+    with redis_timer('name_index.update'):
+        pipe.execute()
+
+
+def search(kind, query, offset=0, size=20):
+    """
+    返回 ([(id, name), ...], has_more)
+    排序：名称完全相同 > 前缀匹配 > 包含，其次名称越短越靠前
+    """
+    query_grams = grams(query, for_query=True)
+    if not query_grams:
+        return [], False
+    with redis_timer('name_index.search'):
+        flat = _lookup(keys=[gram_key(kind, gram) for gram in query_grams] + [names_key(kind)],
+                       args=[CANDIDATE_LIMIT])
+
+    # 片段求交只是候选，名称包含查询串才算命中
+    needle = query.lower()
+    matches = [(entity_id, name) for entity_id, name in zip(flat[::2], flat[1::2])
+               if needle in name.lower()]
+    matches.sort(key=lambda m: (m[1].lower() != needle, not m[1].lower().startswith(needle),
+                                len(m[1]), m[1]))
+    page = matches[offset:offset + size]
+    return page, offset + size < len(matches)
+
+
+def rebuild(batch_size=1000):
+    """清空并重建全部用户名、群名索引"""
+    batch = []
+    for key in r.scan_iter(match='nameidx:*', count=batch_size):
+        batch.append(key)
+        if len(batch) >= batch_size:
+            r.unlink(*batch)
+            batch = []
+    if batch:
+        r.unlink(*batch)
+
+    engine = create_engine(database_uri(), pool_pre_ping=True)
+    users, rooms = User.__table__, Room.__table__
+    queries = [
+        (USER, users.c.user_id, select(users.c.user_id, users.c.username)),
+        (GROUP, rooms.c.room_id, select(rooms.c.room_id, rooms.c.name).where(rooms.c.group_flag == True)),
+    ]
+    with engine.connect() as conn:
+        for kind, id_column, query in queries:
+            last_id, total = None, 0
+            while True:
+                page = query if last_id is None else query.where(id_column > last_id)
+                rows = conn.execute(page.order_by(id_column).limit(batch_size)).all()
+                if not rows:
+                    break
+                pipe = r.pipeline(transaction=False)
+                for entity_id, name in rows:
+                    if name:
+                        index_name(kind, entity_id, name, client=pipe)
+                pipe.execute()
+                last_id = rows[-1][0]
+                total += len(rows)
+            print(f'已索引 {kind} {total} 条')
+
+
+if __name__ == '__main__':
+    if sys.argv[1:] != ['rebuild']:
+        sys.exit('用法：python -m app.name_index rebuild')
+    rebuild()
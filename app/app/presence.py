@@ -0,0 +1,236 @@
+"""
+在线状态
+- 按用户统计连接数：presence:user:{id} 保存该用户的 sid -> worker，多标签页只算一个在线用户
+- 在线用户集合按 user_id 哈希分片为 presence:online:{n}
+- 每个 worker 定期心跳，心跳过期的 worker 由清理任务回收其全部连接
+- 上下线变化先记入待广播集合，按周期合并为差量推送到相关房间
+- 成员被移出房间时通过 pub/sub 通知所有 worker，让其本地连接离开对应的 Socket.IO 房间
+"""
+import json
+import time
+import zlib
+from collections import defaultdict
+
+import redis
+
+from .extensions import socketio
+from .membership import rooms_of, members_of, user_rooms_key
+from .utils import init_redis, redis_timer, WORKER_ID
+
+r = init_redis()
+
+ONLINE_SHARDS = 16
+HEARTBEAT_INTERVAL = 10  # 秒
+HEARTBEAT_TTL = 30       # 超过该时间没有心跳的 worker 视为已失联
+WORKERS_KEY = 'presence:workers'
+CHANGES_KEY = 'presence:changes'
+LAST_COUNT_KEY = 'presence:last_count'
+TICKER_KEY = 'presence:ticker'
+SWEEPER_KEY = 'presence:sweeper'
+LEAVE_CHANNEL = 'presence:leave_room'
+
+# 本进程连接的 sid -> user_id，断开时无需再查 Redis
+_local_sessions = {}
+
+# KEYS: worker 连接表, 用户连接表, 在线分片, 待广播变化, 用户房间缓存
+# ARGV: sid, worker_id, user_id
+# 返回 {是否由 0 个连接变为 1 个, 用户房间缓存成员}，连接登记与房间预取只需一次往返
+_connect = r.register_script("""
+redis.call('HSET', KEYS[1], ARGV[1], ARGV[3])
+redis.call('HSET', KEYS[2], ARGV[1], ARGV[2])
+local came_online = 0
+if redis.call('HLEN', KEYS[2]) == 1 then
+    redis.call('SADD', KEYS[3], ARGV[3])
+    redis.call('HSET', KEYS[4], ARGV[3], 1)
+    came_online = 1
+end
+return {came_online, redis.call('SMEMBERS', KEYS[5])}
+""")
+
+# KEYS: worker 连接表, 用户连接表, 在线分片, 待广播变化
+# ARGV: sid, user_id；用户最后一个连接断开时返回 1
+_disconnect = r.register_script("""
+redis.call('HDEL', KEYS[1], ARGV[1])
+if redis.call('HDEL', KEYS[2], ARGV[1]) == 1 and redis.call('HLEN', KEYS[2]) == 0 then
+    redis.call('SREM', KEYS[3], ARGV[2])
+    redis.call('HSET', KEYS[4], ARGV[2], 0)
+    return 1
+end
+return 0
+""")
+
+_take_changes = r.register_script("""
+local entries = redis.call('HGETALL', KEYS[1])
+redis.call('DEL', KEYS[1])
+return entries
+""")
+
+
+def user_key(user_id):
+    return f'presence:user:{user_id}'
+
+
+def worker_sessions_key(worker_id):
+    return f'presence:worker:{worker_id}:sessions'
+
+
+def worker_alive_key(worker_id):
+    return f'presence:worker:{worker_id}:alive'
+
+
+def online_shard_key(user_id):
+    return f'presence:online:{zlib.crc32(user_id.encode()) % ONLINE_SHARDS}'
+
+
+def connect(sid, user_id):
+    """登记连接，返回用户所在的房间 ID 集合"""
+    _local_sessions[sid] = user_id
+    with redis_timer('presence.connect'):
+        _, cached_rooms = _connect(keys=[worker_sessions_key(WORKER_ID), user_key(user_id),
+                                         online_shard_key(user_id), CHANGES_KEY,
+                                         user_rooms_key(user_id)],
+                                   args=[sid, WORKER_ID, user_id])
+    return rooms_of(user_id, cached=set(cached_rooms))
+
+
+def disconnect(sid, worker_id=WORKER_ID):
+    """返回断开连接的 user_id，未登记的 sid 返回 None"""
+    # 本进程的连接直接取本地映射，清理失联 worker 时才需要查 Redis
+    user_id = _local_sessions.pop(sid, None) if worker_id == WORKER_ID else None
+    with redis_timer('presence.disconnect'):
+        if user_id is None:
+            user_id = r.hget(worker_sessions_key(worker_id), sid)
+        if user_id:
+            _disconnect(keys=[worker_sessions_key(worker_id), user_key(user_id),
+                              online_shard_key(user_id), CHANGES_KEY],
+                        args=[sid, user_id])
+    return user_id
+
+
+def connection_count(user_id):
+    return r.hlen(user_key(user_id))
+
+
+def online_count():
+    pipe = r.pipeline(transaction=False)
+    for shard in range(ONLINE_SHARDS):
+        pipe.scard(f'presence:online:{shard}')
+    return sum(pipe.execute())
+
+
+def online_members(room_id):
+    """返回房间内在线成员的 user_id 列表"""
+    by_shard = defaultdict(list)
+    for user_id in members_of(room_id):
+        by_shard[online_shard_key(user_id)].append(user_id)
+    if not by_shard:
+        return []
+    pipe = r.pipeline(transaction=False)
+    for shard_key, user_ids in by_shard.items():
+        pipe.smismember(shard_key, user_ids)
+    online = []
+    for user_ids, flags in zip(by_shard.values(), pipe.execute()):
+        online.extend(user_id for user_id, flag in zip(user_ids, flags) if flag)
+    return sorted(online)
+
+
+def leave_room(room_id, user_ids):
+    """成员关系已删除后调用：所有 worker 上这些用户的连接离开房间，不再收到房间广播"""
+    try:
+        r.publish(LEAVE_CHANNEL, json.dumps({'room_id': str(room_id), 'user_ids': list(user_ids)}))
+    except redis.RedisError:
+        pass
+
+
+def _listen_leaves(app):
+    while True:
+        pubsub = r.pubsub(ignore_subscribe_messages=True)
+        try:
+            pubsub.subscribe(LEAVE_CHANNEL)
+            for message in pubsub.listen():
+                try:
+                    _apply_leave(message)
+                except Exception as e:
+                    # 单条消息格式错误只丢弃该条，不影响订阅
+                    app.logger.error(f'处理离开房间通知失败: {str(e)}')
+        except Exception as e:
+            # 任何异常都不能结束后台任务，否则成员被移除后仍会收到房间广播
+            app.logger.error(f'离开房间订阅中断: {str(e)}')
+            time.sleep(1)
+        finally:
+            pubsub.close()
+
+
+def _apply_leave(message):
+    data = json.loads(message['data'])
+    user_ids = set(data['user_ids'])
+    for sid, user_id in list(_local_sessions.items()):
+        if user_id in user_ids:
+            socketio.server.leave_room(sid, data['room_id'], namespace='/')
+
+
+def start_presence_tasks(app):
+    socketio.start_background_task(_heartbeat, app)
+    socketio.start_background_task(_broadcast_diffs, app)
+    socketio.start_background_task(_listen_leaves, app)
+
+
+def _heartbeat(app):
+    while True:
+        try:
+            pipe = r.pipeline()
+            pipe.set(worker_alive_key(WORKER_ID), 1, ex=HEARTBEAT_TTL)
+            pipe.sadd(WORKERS_KEY, WORKER_ID)
+            pipe.execute()
+            # 同一周期只允许一个 worker 执行清理
+            if r.set(SWEEPER_KEY, 1, nx=True, ex=HEARTBEAT_INTERVAL):
+                _sweep_dead_workers(app)
+        except Exception as e:
+            app.logger.error(f'在线状态心跳失败: {str(e)}')
+        socketio.sleep(HEARTBEAT_INTERVAL)
+
+
+def _sweep_dead_workers(app):
+    for worker_id in r.smembers(WORKERS_KEY):
+        if r.exists(worker_alive_key(worker_id)):
+            continue
+        sids = r.hkeys(worker_sessions_key(worker_id))
+        for sid in sids:
+            disconnect(sid, worker_id)
+        pipe = r.pipeline()
+        pipe.delete(worker_sessions_key(worker_id))
+        pipe.srem(WORKERS_KEY, worker_id)
+        pipe.execute()
+        app.logger.info(f'回收失联 worker {worker_id} 的 {len(sids)} 个连接')
+
+
+def _broadcast_diffs(app):
+    interval = app.config['PRESENCE_DIFF_INTERVAL_MS'] / 1000
+    while True:
+        socketio.sleep(interval)
+        try:
+            if r.set(TICKER_KEY, 1, nx=True, px=max(1, int(interval * 900))):
+                with app.app_context():
+                    _emit_diffs()
+        except Exception as e:
+            # 任何异常都不能结束后台任务，否则所有 worker 的上下线差量都不再推送
+            app.logger.error(f'在线状态广播失败: {str(e)}')
+
+
+def _emit_diffs():
+    flat = _take_changes(keys=[CHANGES_KEY])
+    if not flat:
+        return
+
+    # 按房间合并上下线差量，只推送给相关房间
+    diffs = defaultdict(lambda: {'online': [], 'offline': []})
+    for user_id, state in zip(flat[::2], flat[1::2]):
+        for room_id in rooms_of(user_id):
+            diffs[room_id]['online' if state == '1' else 'offline'].append(user_id)
+    for room_id, diff in diffs.items():
+        socketio.emit('presence', dict(diff, room_id=room_id), room=str(room_id))
+
+    # 在线人数变化时才广播
+    count = online_count()
+    if r.getset(LAST_COUNT_KEY, count) != str(count):
+        socketio.emit('online', {'count': count})
@@ -0,0 +1,132 @@
+"""
+已读回执合并
+- 按 (room, user) 在 Redis 中只保留最大 seq，忽略回退
+- 后台定时取出全部待处理回执，批量 UPDATE room_member 后一次提交
+- 每个房间每个周期只广播一次聚合后的 read_receipts 事件
+- Redis 不可用时退回逐条直接更新 room_member
+"""
+from collections import defaultdict
+
+import redis
+from flask import current_app
+from sqlalchemy import text
+
+from .extensions import db, socketio
+from .utils import init_redis, redis_timer
+
+r = init_redis()
+
+PENDING_KEY = 'read_receipts:pending'
+
+_record_if_newer = r.register_script("""
+local cur = tonumber(redis.call('HGET', KEYS[1], ARGV[1]) or '-1')
+if tonumber(ARGV[2]) > cur then
+    redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+    return 1
+end
+return 0
+""")
+
+# 原子地取出并清空待处理回执
+_take_pending = r.register_script("""
+local entries = redis.call('HGETALL', KEYS[1])
+redis.call('DEL', KEYS[1])
+return entries
+""")
+
+stats = {'received': 0, 'flushed': 0, 'batches': 0}
+
+
+def record_receipt(room_id, user_id, last_read_seq):
+    stats['received'] += 1
+    try:
+        with redis_timer('receipts.record'):
+            _record_if_newer(keys=[PENDING_KEY], args=[f'{room_id}:{user_id}', last_read_seq])
+    except redis.RedisError:
+        # Redis 不可用时不合并，直接写库并广播这一条回执
+        receipts = [{'room_id': room_id, 'user_id': user_id, 'seq': last_read_seq}]
+        try:
+            _update_read_seq(receipts)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        _broadcast(receipts)
+
+
+def start_receipt_flusher(app):
+    socketio.start_background_task(_run, app)
+
+
+def _run(app):
+    interval = app.config['RECEIPT_FLUSH_INTERVAL_MS'] / 1000
+    with app.app_context():
+        while True:
+            socketio.sleep(interval)
+            try:
+                flush_receipts()
+            except Exception as e:
+                db.session.rollback()
+                app.logger.error(f'已读回执落库失败: {str(e)}')
+
+
+def flush_receipts():
+    try:
+        flat = _take_pending(keys=[PENDING_KEY])
+    except redis.RedisError:
+        return 0
+    if not flat:
+        return 0
+
+    receipts = []
+    for field, seq in zip(flat[::2], flat[1::2]):
+        # 待处理回执已整体取出，单条无法解析时只丢弃这一条，不能让整批回执随异常一起丢失
+        try:
+            room_id, user_id = field.split(':', 1)
+            receipts.append({'room_id': int(room_id), 'user_id': user_id, 'seq': int(seq)})
+        except ValueError:
+            current_app.logger.warning(f'丢弃无法解析的已读回执: {field}={seq}')
+    if not receipts:
+        return 0
+
+    try:
+        # 同一事务内批量更新
+        _update_read_seq(receipts)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        # 写库失败时放回待处理队列，下个周期重试
+        pipe = r.pipeline(transaction=False)
+        for receipt in receipts:
+            _record_if_newer(keys=[PENDING_KEY], client=pipe,
+                             args=[f"{receipt['room_id']}:{receipt['user_id']}", receipt['seq']])
+        pipe.execute()
+        raise
+
+    _broadcast(receipts)
+    stats['flushed'] += len(receipts)
+    stats['batches'] += 1
+    return len(receipts)
+
+
+def _update_read_seq(receipts):
+    # GREATEST 保证阅读位置不回退
+    db.session.execute(text(
+        "UPDATE room_member SET last_read_seq = GREATEST(COALESCE(last_read_seq, 0), :seq) "
+        "WHERE room_id = :room_id AND user_id = :user_id"
+    ), receipts)
+
+
+def _broadcast(receipts):
+    # 每个房间只发一次聚合事件
+    by_room = defaultdict(list)
+    for receipt in receipts:
+        by_room[receipt['room_id']].append({
+            'user_id': receipt['user_id'],
+            'last_read_seq': receipt['seq']
+        })
+    for room_id, room_receipts in by_room.items():
+        socketio.emit('read_receipts', {
+            'room_id': room_id,
+            'receipts': room_receipts
+        }, room=str(room_id))
@@ -0,0 +1,80 @@
+"""
+JWT 吊销存储
+- Redis 中以 jwt:revoked:{jti} 保存，TTL 等于 Token 剩余有效期，所有 worker 共享且重启不丢失
+- 进程内布隆过滤器做否定缓存：未命中即可确认未吊销，无需访问 Redis
+- 吊销时通过 pub/sub 通知所有 worker 更新布隆过滤器，并定期从 Redis 重建以清除过期项
+"""
+import time
+
+import redis
+
+from .cache import BloomFilter
+from .utils import init_redis
+
+r = init_redis()
+
+INDEX_KEY = 'jwt:revoked'  # 有序集合：jti -> 过期时间戳，用于重建布隆过滤器
+CHANNEL = 'jwt:revoked:events'
+REBUILD_INTERVAL = 3600
+
+# ready 为 False 时（启动中或与 Redis 断开）布隆过滤器可能不完整，需直接查 Redis
+_state = {'bloom': BloomFilter(), 'ready': False}
+
+
+def revoked_key(jti):
+    return f'jwt:revoked:{jti}'
+
+
+def revoke(jti, exp):
+    ttl = max(int(exp - time.time()), 1)
+    _state['bloom'].add(jti)
+    pipe = r.pipeline()
+    pipe.set(revoked_key(jti), 1, ex=ttl)
+    pipe.zadd(INDEX_KEY, {jti: exp})
+    pipe.publish(CHANNEL, jti)
+    pipe.execute()
+
+
+def is_revoked(jti):
+    if _state['ready'] and jti not in _state['bloom']:
+        return False
+    try:
+        return r.exists(revoked_key(jti)) == 1
+    except redis.RedisError:
+        # Redis 不可用时以布隆过滤器为准：可能误判为已吊销，但不会放过已吊销的 Token
+        return jti in _state['bloom']
+
+
+def _rebuild():
+    bloom = BloomFilter()
+    pipe = r.pipeline()
+    pipe.zremrangebyscore(INDEX_KEY, '-inf', time.time())
+    pipe.zrange(INDEX_KEY, 0, -1)
+    _, jtis = pipe.execute()
+    for jti in jtis:
+        bloom.add(jti)
+    _state['bloom'] = bloom
+
+
+def listen():
+    """常驻后台：先订阅再全量加载，保证两者之间的吊销事件不丢失"""
+    while True:
+        pubsub = r.pubsub(ignore_subscribe_messages=True)
+        try:
+            pubsub.subscribe(CHANNEL)
+            _rebuild()
+            _state['ready'] = True
+            rebuilt_at = time.monotonic()
+            while True:
+                message = pubsub.get_message(timeout=1)
+                if message:
+                    _state['bloom'].add(message['data'])
+                if time.monotonic() - rebuilt_at > REBUILD_INTERVAL:
+                    _rebuild()
+                    rebuilt_at = time.monotonic()
+        except redis.RedisError:
+            _state['ready'] = False
+            time.sleep(1)
+        finally:
+            # 重连前关闭旧的 pubsub，归还其占用的连接
+            pubsub.close()
@@ -1,9 +1,16 @@
 # app/room.py
+from collections import defaultdict
+
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
 
 from .extensions import socketio
-from .models import db, Room, RoomMember, User, FriendRequest
+from .models import db, Room, RoomMember, User
+from .friend_graph import is_friend, friends_among
+from . import presence
+from .membership import add_members, remove_member, remove_members, is_member
+from . import name_index
+from .summary import get_summaries
 
 room_bp = Blueprint('room', __name__, url_prefix='/rooms')
 
@@ -14,13 +21,13 @@ def search():
     if not query:
         return jsonify({'code': 1, 'msg': '查询参数不能为空'}), 400
 
-    rooms = Room.query.filter(
-        Room.name.like(f"%{query}%"),
-        Room.group_flag == True  # 只搜索群聊
-    ).all()
+    offset = max(0, request.args.get('offset', 0, type=int))
+    size = max(1, min(request.args.get('size', 20, type=int), 50))
 
-    room_list = [{'room_id': room.room_id, 'name': room.name} for room in rooms]
-    return jsonify({'code': 0, 'rooms': room_list}), 200
+    # 索引中只有群聊
+    matches, has_more = name_index.search(name_index.GROUP, query, offset, size)
+    room_list = [{'room_id': int(room_id), 'name': name} for room_id, name in matches]
+    return jsonify({'code': 0, 'rooms': room_list, 'has_more': has_more}), 200
 
 @room_bp.post('/create_private')
 @jwt_required()
@@ -30,38 +37,74 @@ def create_private_chat():
 
     if not target_user_id:
         return jsonify({'code': 1, 'msg': '目标用户ID不能为空'}), 400
+    # 客户端可能传数字，统一为字符串后再比较和排序
+    target_user_id = str(target_user_id)
 
     if current_user_id == target_user_id:
         return jsonify({'code': 1, 'msg': '不能与自己创建私聊'}), 400
 
     # 检查是否已经是好友
-    if not FriendRequest.is_friend(current_user_id, target_user_id):
+    if not is_friend(current_user_id, target_user_id):
         return jsonify({'code': 1, 'msg': '只能与好友创建私聊'}), 400
 
-    # 检查是否已存在私聊房间
-    existing_room = db.session.query(Room).join(
-        RoomMember, Room.room_id == RoomMember.room_id
-    ).filter(
-        Room.group_flag == False,
-        RoomMember.user_id.in_([current_user_id, target_user_id])
-    ).group_by(Room.room_id).having(db.func.count(RoomMember.user_id) == 2).first()
+    # 按双方 ID 组成的唯一键查找或创建私聊房间
+    room_id, created = Room.get_or_create_private(current_user_id, target_user_id)
+    add_members(room_id, [current_user_id, target_user_id])
+    if not created:
+        return jsonify({'code': 0, 'room_id': room_id, 'msg': '私聊已存在'}), 200
+    return jsonify({'code': 0, 'room_id': room_id, 'msg': '私聊创建成功'}), 201
 
-    if existing_room:
-        return jsonify({'code': 0, 'room_id': existing_room.room_id, 'msg': '私聊已存在'}), 200
 
-    # 创建新私聊房间
-    room = Room(group_flag=False, name=None, owner=None)
-    db.session.add(room)
-    db.session.flush()  # 获取room_id但不提交
+def _member_ids(value):
+    """请求中的成员 ID 列表去重并统一为字符串"""
+    if not isinstance(value, list):
+        return []
+    return list(dict.fromkeys(str(member_id) for member_id in value if member_id))
+
 
-    # 添加两个用户到房间
-    member1 = RoomMember(room_id=room.room_id, user_id=current_user_id, last_read_seq=0)
-    member2 = RoomMember(room_id=room.room_id, user_id=target_user_id, last_read_seq=0)
+def _insert_members(room_id, user_ids):
+    # executemany 由 PyMySQL 合并为一条多行 INSERT；已在房间中的成员由唯一索引忽略
+    if user_ids:
+        db.session.execute(RoomMember.__table__.insert().prefix_with('IGNORE'), [
+            {'room_id': room_id, 'user_id': user_id, 'last_read_seq': 0} for user_id in user_ids
+        ])
 
-    db.session.add_all([member1, member2])
+
+def _owned_group(room_id, current_user_id):
+    """返回 (群聊, 错误响应)，只有群主可以管理成员"""
+    room = Room.query.get(room_id) if room_id else None
+    if not room:
+        return None, (jsonify({'code': 1, 'msg': '房间不存在'}), 404)
+    if not room.group_flag:
+        return None, (jsonify({'code': 1, 'msg': '私聊不能管理成员'}), 400)
+    if room.owner != current_user_id:
+        return None, (jsonify({'code': 1, 'msg': '只有群主可以管理成员'}), 403)
+    return room, None
+
+
+def _add_group_members(room, inviter_id, member_ids):
+    """把群主的好友批量加入群聊，返回实际加入的成员 ID 列表"""
+    # 好友关系一次批量校验，已在群中的成员一次查询排除
+    candidates = friends_among(inviter_id, member_ids)
+    if candidates:
+        existing = {user_id for (user_id,) in db.session.query(RoomMember.user_id).filter(
+            RoomMember.room_id == room.room_id, RoomMember.user_id.in_(candidates))}
+        candidates -= existing
+    added_ids = [member_id for member_id in member_ids if member_id in candidates]
+    if not added_ids:
+        return []
+
+    _insert_members(room.room_id, added_ids)
     db.session.commit()
+    add_members(room.room_id, added_ids)
 
-    return jsonify({'code': 0, 'room_id': room.room_id, 'msg': '私聊创建成功'}), 201
+    # 通知新成员；现有成员的通知由调用方按单个或批量发送
+    socketio.emit('added_to_group', {
+        'room_id': room.room_id,
+        'room_name': room.name,
+        'added_by': inviter_id
+    }, to=added_ids)
+    return added_ids
 
 
 @room_bp.post('/create_group')
@@ -69,7 +112,7 @@ def create_private_chat():
 def create_group_chat():
     current_user_id = get_jwt_identity()
     room_name = request.json.get('room_name')
-    member_ids = request.json.get('member_ids', [])
+    member_ids = _member_ids(request.json.get('member_ids', []))
 
     if not room_name:
         return jsonify({'code': 1, 'msg': '群聊名称不能为空'}), 400
@@ -79,70 +122,134 @@ def create_group_chat():
     db.session.add(room)
     db.session.flush()
 
-    # 添加创建者到房间
-    creator_member = RoomMember(room_id=room.room_id, user_id=current_user_id, last_read_seq=0)
-    db.session.add(creator_member)
-
-    # 添加其他成员到房间
-    for member_id in member_ids:
-        if member_id != current_user_id and FriendRequest.is_friend(current_user_id, member_id):
-            member = RoomMember(room_id=room.room_id, user_id=member_id, last_read_seq=0)
-            db.session.add(member)
-
+    # 创建者与其好友一次批量写入
+    friend_ids = friends_among(current_user_id, member_ids)
+    added_ids = [current_user_id] + [member_id for member_id in member_ids if member_id in friend_ids]
+    _insert_members(room.room_id, added_ids)
     db.session.commit()
+    add_members(room.room_id, added_ids)
+    name_index.index_name(name_index.GROUP, room.room_id, room_name)
 
-    # 通知所有成员有新群聊
-    for member_id in [current_user_id] + member_ids:
-        if member_id != current_user_id:  # 不重复通知自己
-            socketio.emit('new_group', {
-                'room_id': room.room_id,
-                'room_name': room_name,
-                'creator_id': current_user_id
-            }, room=member_id)
+    # 通知所有成员有新群聊，一次广播到全部成员的个人房间
+    if len(added_ids) > 1:
+        socketio.emit('new_group', {
+            'room_id': room.room_id,
+            'room_name': room_name,
+            'creator_id': current_user_id
+        }, to=added_ids[1:])
 
-    return jsonify({'code': 0, 'room_id': room.room_id, 'msg': '群聊创建成功'}), 201
+    return jsonify({'code': 0, 'room_id': room.room_id, 'member_ids': added_ids, 'msg': '群聊创建成功'}), 201
 
 
 @room_bp.get('/get_user_rooms')
 @jwt_required()
 def get_user_rooms():
     current_user_id = get_jwt_identity()
+    # compact=1 时不返回完整成员列表，只返回成员数和私聊对方名称
+    compact = request.args.get('compact', 0, type=int) == 1
 
-    # 获取用户加入的所有房间
-    user_rooms = db.session.query(Room).join(
+    # 获取用户加入的所有房间及阅读位置
+    user_rooms = db.session.query(Room, RoomMember.last_read_seq).join(
         RoomMember, Room.room_id == RoomMember.room_id
     ).filter(RoomMember.user_id == current_user_id).all()
+    room_ids = [room.room_id for room, _ in user_rooms]
+    if not room_ids:
+        return jsonify({'code': 0, 'rooms': []}), 200
+
+    # 各房间最新消息序号（取自 Redis 房间摘要，缺失时批量回源）
+    summaries = get_summaries(room_ids)
+
+    # 获取房间成员：精简模式只取私聊的对方成员，成员数单独聚合
+    if compact:
+        member_counts = dict(db.session.query(RoomMember.room_id, db.func.count(RoomMember.id))
+                             .filter(RoomMember.room_id.in_(room_ids))
+                             .group_by(RoomMember.room_id).all())
+        private_ids = [room.room_id for room, _ in user_rooms if not room.group_flag]
+        member_rows = db.session.query(RoomMember.room_id, RoomMember.user_id).filter(
+            RoomMember.room_id.in_(private_ids),
+            RoomMember.user_id != current_user_id
+        ).all() if private_ids else []
+    else:
+        member_rows = db.session.query(RoomMember.room_id, RoomMember.user_id).filter(
+            RoomMember.room_id.in_(room_ids)
+        ).all()
 
-    room_list = []
-    for room in user_rooms:
-        # 获取房间成员信息
-        members = db.session.query(User).join(
-            RoomMember, User.user_id == RoomMember.user_id
-        ).filter(RoomMember.room_id == room.room_id).all()
+    members_by_room = defaultdict(list)
+    for room_id, user_id in member_rows:
+        members_by_room[room_id].append(user_id)
+    if not compact:
+        member_counts = {room_id: len(user_ids) for room_id, user_ids in members_by_room.items()}
+    usernames = User.usernames({user_id for _, user_id in member_rows})
 
-        member_info = [{
-            'user_id': member.user_id,
-            'username': member.username
-        } for member in members]
+    room_list = []
+    for room, last_read_seq in user_rooms:
+        member_ids = members_by_room[room.room_id]
 
         # 对于私聊，显示对方用户名
         if not room.group_flag:
-            other_member = next((m for m in members if m.user_id != current_user_id), None)
-            display_name = other_member.username if other_member else '未知用户'
+            other_id = next((user_id for user_id in member_ids if user_id != current_user_id), None)
+            display_name = usernames.get(other_id) or '未知用户'
         else:
             display_name = room.name
 
-        room_list.append({
+        head_seq = summaries[room.room_id]['head_seq']
+        last_read_seq = last_read_seq or 0
+        room_info = {
             'id': room.room_id,
             'name': display_name,
             'is_group': room.group_flag,
-            'members': member_info,
-            'last_read_seq': next((rm.last_read_seq for rm in room.members if rm.user_id == current_user_id), 0)
-        })
+            'member_count': member_counts.get(room.room_id, 0),
+            'last_read_seq': last_read_seq,
+            'head_seq': head_seq,
+            'unread': max(head_seq - last_read_seq, 0)
+        }
+        if not compact:
+            room_info['members'] = [{
+                'user_id': user_id,
+                'username': usernames[user_id]
+            } for user_id in member_ids]
+        room_list.append(room_info)
 
     return jsonify({'code': 0, 'rooms': room_list}), 200
 
 
+@room_bp.get('/summary')
+@jwt_required()
+def summary():
+    current_user_id = get_jwt_identity()
+
+    # 一次查询取出用户的所有房间及阅读位置，摘要从 Redis 批量读取
+    memberships = db.session.query(RoomMember.room_id, RoomMember.last_read_seq).filter(
+        RoomMember.user_id == current_user_id
+    ).all()
+    summaries = get_summaries([room_id for room_id, _ in memberships])
+
+    room_list = []
+    for room_id, last_read_seq in memberships:
+        room_summary = summaries[room_id]
+        last_read_seq = last_read_seq or 0
+        room_list.append(dict(room_summary,
+                              last_read_seq=last_read_seq,
+                              unread=max(room_summary['head_seq'] - last_read_seq, 0)))
+
+    return jsonify({'code': 0, 'rooms': room_list}), 200
+
+
+@room_bp.get('/online')
+@jwt_required()
+def online_members():
+    current_user_id = get_jwt_identity()
+    room_id = request.args.get('room_id', type=int)
+
+    if not room_id:
+        return jsonify({'code': 1, 'msg': '房间ID不能为空'}), 400
+
+    if not is_member(room_id, current_user_id):
+        return jsonify({'code': 1, 'msg': '您不在该房间中'}), 403
+
+    return jsonify({'code': 0, 'room_id': room_id, 'online': presence.online_members(room_id)}), 200
+
+
 @room_bp.post('/add_member')
 @jwt_required()
 def add_member_to_room():
@@ -153,46 +260,119 @@ def add_member_to_room():
     if not room_id or not member_id:
         return jsonify({'code': 1, 'msg': '房间ID和成员ID不能为空'}), 400
 
-    # 检查房间是否存在且当前用户是群主
-    room = Room.query.get(room_id)
-    if not room:
-        return jsonify({'code': 1, 'msg': '房间不存在'}), 404
-
-    if not room.group_flag:
-        return jsonify({'code': 1, 'msg': '不能向私聊添加成员'}), 400
-
-    if room.owner != current_user_id:
-        return jsonify({'code': 1, 'msg': '只有群主可以添加成员'}), 403
+    room, error = _owned_group(room_id, current_user_id)
+    if error:
+        return error
 
     # 检查是否已经是好友
-    if not FriendRequest.is_friend(current_user_id, member_id):
+    member_id = str(member_id)
+    if not is_friend(current_user_id, member_id):
         return jsonify({'code': 1, 'msg': '只能添加好友到群聊'}), 400
 
-    # 检查是否已在房间中
-    existing_member = RoomMember.query.filter_by(room_id=room_id, user_id=member_id).first()
-    if existing_member:
+    if not _add_group_members(room, current_user_id, [member_id]):
         return jsonify({'code': 1, 'msg': '用户已在群聊中'}), 400
+    # 单个加人沿用 new_member 事件，批量加人用 new_members
+    socketio.emit('new_member', {
+        'room_id': room.room_id,
+        'member_id': member_id,
+        'username': User.get_username(member_id)
+    }, room=str(room.room_id))
+    return jsonify({'code': 0, 'msg': '成员添加成功'}), 200
+
+
+@room_bp.post('/add_members')
+@jwt_required()
+def add_members_to_room():
+    current_user_id = get_jwt_identity()
+    room_id = request.json.get('room_id')
+    member_ids = _member_ids(request.json.get('member_ids'))
+
+    if not room_id or not member_ids:
+        return jsonify({'code': 1, 'msg': '房间ID和成员ID不能为空'}), 400
+
+    room, error = _owned_group(room_id, current_user_id)
+    if error:
+        return error
+
+    # 非好友、已在群中的成员直接跳过
+    added_ids = _add_group_members(room, current_user_id, member_ids)
+    if added_ids:
+        usernames = User.usernames(added_ids)
+        socketio.emit('new_members', {
+            'room_id': room.room_id,
+            'members': [{'member_id': member_id, 'username': usernames[member_id]} for member_id in added_ids]
+        }, room=str(room.room_id))
+    added = set(added_ids)
+    skipped_ids = [member_id for member_id in member_ids if member_id not in added]
+    return jsonify({'code': 0, 'added': added_ids, 'skipped': skipped_ids, 'msg': '成员添加成功'}), 200
+
+
+@room_bp.post('/remove_members')
+@jwt_required()
+def remove_members_from_room():
+    current_user_id = get_jwt_identity()
+    room_id = request.json.get('room_id')
+    member_ids = [member_id for member_id in _member_ids(request.json.get('member_ids'))
+                  if member_id != current_user_id]  # 群主通过退群或转让离开
 
-    # 添加成员
-    member = RoomMember(room_id=room_id, user_id=member_id, last_read_seq=0)
-    db.session.add(member)
+    if not room_id or not member_ids:
+        return jsonify({'code': 1, 'msg': '房间ID和成员ID不能为空'}), 400
+
+    room, error = _owned_group(room_id, current_user_id)
+    if error:
+        return error
+
+    removed_ids = [user_id for (user_id,) in db.session.query(RoomMember.user_id).filter(
+        RoomMember.room_id == room.room_id, RoomMember.user_id.in_(member_ids))]
+    if not removed_ids:
+        return jsonify({'code': 1, 'msg': '成员不在群聊中'}), 400
+
+    # 一条 DELETE 删除全部成员
+    RoomMember.query.filter(
+        RoomMember.room_id == room.room_id, RoomMember.user_id.in_(removed_ids)
+    ).delete(synchronize_session=False)
     db.session.commit()
+    remove_members(room.room_id, removed_ids)
+    presence.leave_room(room.room_id, removed_ids)
 
-    # 通知新成员
-    socketio.emit('added_to_group', {
-        'room_id': room_id,
-        'room_name': room.name,
-        'added_by': current_user_id
-    }, room=member_id)
+    socketio.emit('removed_from_group', {
+        'room_id': room.room_id,
+        'removed_by': current_user_id
+    }, to=removed_ids)
+    socketio.emit('members_removed', {
+        'room_id': room.room_id,
+        'member_ids': removed_ids
+    }, room=str(room.room_id))
+    return jsonify({'code': 0, 'removed': removed_ids, 'msg': '成员移除成功'}), 200
 
-    # 通知现有成员
-    socketio.emit('new_member', {
-        'room_id': room_id,
-        'member_id': member_id,
-        'username': User.find_by_id(member_id).username
-    }, room=room_id, include_self=False)
 
-    return jsonify({'code': 0, 'msg': '成员添加成功'}), 200
+@room_bp.post('/transfer_owner')
+@jwt_required()
+def transfer_owner():
+    current_user_id = get_jwt_identity()
+    room_id = request.json.get('room_id')
+    new_owner = request.json.get('new_owner_id')
+
+    if not room_id or not new_owner:
+        return jsonify({'code': 1, 'msg': '房间ID和新群主ID不能为空'}), 400
+
+    room, error = _owned_group(room_id, current_user_id)
+    if error:
+        return error
+
+    new_owner = str(new_owner)
+    if new_owner == current_user_id or not is_member(room.room_id, new_owner):
+        return jsonify({'code': 1, 'msg': '新群主必须是群内其他成员'}), 400
+
+    room.owner = new_owner
+    db.session.commit()
+
+    socketio.emit('owner_changed', {
+        'room_id': room.room_id,
+        'new_owner_id': new_owner,
+        'new_owner_name': User.get_username(new_owner)
+    }, room=str(room.room_id))
+    return jsonify({'code': 0, 'msg': '群主转让成功'}), 200
 
 
 @room_bp.post('/leave_room')
@@ -215,6 +395,7 @@ def leave_room():
         return jsonify({'code': 1, 'msg': '您不在该房间中'}), 400
 
     # 如果是群主，需要转移群主权限或解散群聊
+    dissolved, room_name = False, room.name
     if room.group_flag and room.owner == current_user_id:
         # 查找其他成员
         other_members = RoomMember.query.filter(
@@ -232,21 +413,27 @@ def leave_room():
             socketio.emit('owner_changed', {
                 'room_id': room_id,
                 'new_owner_id': new_owner,
-                'new_owner_name': User.find_by_id(new_owner).username
-            }, room=room_id)
+                'new_owner_name': User.get_username(new_owner)
+            }, room=str(room_id))
         else:
             # 没有其他成员，删除房间
             db.session.delete(room)
+            dissolved = True
 
     # 移除成员关系
     db.session.delete(membership)
     db.session.commit()
+    remove_member(room_id, current_user_id)
+    presence.leave_room(room_id, [current_user_id])
+    if dissolved:
+        # 已解散的群不应再出现在群名搜索结果中
+        name_index.remove(name_index.GROUP, room_id, room_name)
 
-    # 通知其他成员
+    # 通知其他成员；这是 HTTP 请求，没有 sid 可供 include_self=False 排除，退出者的连接已由 presence.leave_room 移出房间
     socketio.emit('member_left', {
         'room_id': room_id,
         'user_id': current_user_id,
-        'username': User.find_by_id(current_user_id).username
-    }, room=room_id, include_self=False)
+        'username': User.get_username(current_user_id)
+    }, room=str(room_id))
 
     return jsonify({'code': 0, 'msg': '已退出房间'}), 200
\ No newline at end of file
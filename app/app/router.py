@@ -1,5 +1,8 @@
 # app/router.py
 from flask import render_template
+from flask_jwt_extended import jwt_required
+
+from .utils import redis_stats
 
 def register_routes(app):
     # 主页
@@ -31,3 +34,10 @@ def register_routes(app):
     @app.get('/health')
     def health():
         return {'status': 'ok'}
+
+    # Redis 分组耗时统计（本 worker），暴露内部调用情况，需登录
+    @app.get('/health/redis')
+    @jwt_required()
+    def health_redis():
+        return {group: dict(stat, avg_ms=stat['total_ms'] / stat['count'])
+                for group, stat in redis_stats.items()}
@@ -0,0 +1,244 @@
+"""
+消息全文搜索
+- 倒排索引存放在 Redis：每个房间每个词一个有序集合 search:{room_id}:{token}，成员为 seq，分数为发送时间（毫秒）
+- 分词：中日韩字符按单字及相邻两字切分（bigram），字母数字按整词切分，统一转小写
+- 发消息时增量写入索引；历史消息通过 python -m app.search rebuild 重建
+- 查询只在用户所在的房间内进行，由 Lua 脚本从最短的倒排表出发逐条求交，再回表校验原文
+- 房间分批查询，所有房间共享一个候选检查预算；凑满一页后只继续查找更新的消息
+"""
+import re
+import sys
+from datetime import timezone
+
+from flask import Blueprint, request, jsonify
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from sqlalchemy import create_engine, select, tuple_
+
+from .extensions import limiter
+from .membership import rooms_of
+from .models import Message, User
+from .utils import init_redis, redis_timer, database_uri, encode_cursor, decode_cursor
+
+search_bp = Blueprint('search', __name__, url_prefix='/search')
+r = init_redis()
+
+KEY_PREFIX = 'search'
+MAX_TOKENS = 512        # 单条消息最多索引的词数，防止超长消息产生过多倒排项
+MAX_QUERY_TOKENS = 8
+SCAN_LIMIT = 5000       # 单个房间最多检查的候选数
+SCAN_BUDGET = 20000     # 一次查询所有房间合计最多检查的候选数，保证查询耗时有上限
+ROOM_BATCH = 50         # 每次脚本调用处理的房间数，避免单个脚本长时间阻塞 Redis
+
+# 假名、CJK 扩展 A、CJK 基本区、韩文音节、CJK 兼容表意文字
+_CJK = '\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff'
+_TOKEN_RE = re.compile(f'[{_CJK}]+|[a-z0-9]+')
+_CJK_RE = re.compile(f'[{_CJK}]')
+
+# KEYS: 各房间的倒排表，每个房间 ARGV[1] 个
+# ARGV: 每个房间的词数, 每个房间最多返回条数, 分数上限（不含）, 分数下限, 单个房间最多检查的候选数, 本次最多检查的候选数, 房间 ID...
+# 返回扁平数组 {实际检查的候选数, room_id, seq, score, ...}
+_intersect = r.register_script("""
+local ntok = tonumber(ARGV[1])
+local limit = tonumber(ARGV[2])
+local max = '(' .. ARGV[3]
+local min = ARGV[4]
+local scan_limit = tonumber(ARGV[5])
+local budget = tonumber(ARGV[6])
+local out = {0}
+local scanned = 0
+for i = 7, #ARGV do
+    if scanned >= budget then break end
+    local base = (i - 7) * ntok
+    local shortest, shortest_card = nil, nil
+    for j = 1, ntok do
+        local card = redis.call('ZCARD', KEYS[base + j])
+        if shortest_card == nil or card < shortest_card then
+            shortest, shortest_card = j, card
+        end
+    end
+    if shortest_card > 0 then
+        local candidates = redis.call('ZREVRANGEBYSCORE', KEYS[base + shortest], max, min,
+                                      'WITHSCORES', 'LIMIT', 0, math.min(scan_limit, budget - scanned))
+        local found = 0
+        for c = 1, #candidates, 2 do
+            scanned = scanned + 1
+            local seq = candidates[c]
+            local hit = true
+            for j = 1, ntok do
+                if j ~= shortest and not redis.call('ZSCORE', KEYS[base + j], seq) then
+                    hit = false
+                    break
+                end
+            end
+            if hit then
+                table.insert(out, ARGV[i])
+                table.insert(out, seq)
+                table.insert(out, candidates[c + 1])
+                found = found + 1
+                if found >= limit then break end
+            end
+        end
+    end
+end
+out[1] = scanned
+return out
+""")
+
+
+def tokenize(text, for_query=False):
+    """
+    中日韩连续字符切成 bigram，字母数字按整词，去重后返回
+    建索引时额外收录单字，使单字查询也能命中；查询时只有单字的片段才用单字
+    """
+    tokens = []
+    for run in _TOKEN_RE.findall(text.lower()):
+        if _CJK_RE.match(run):
+            if len(run) == 1 or not for_query:
+                tokens.extend(run)
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            tokens.append(run)
+    return list(dict.fromkeys(tokens))
+
+
+def token_key(room_id, token):
+    return f'{KEY_PREFIX}:{room_id}:{token}'
+
+
+def _score(ts):
+    # 消息时间为 UTC naive datetime
+    return int(ts.replace(tzinfo=timezone.utc).timestamp() * 1000)
+
+
+def index_message(room_id, seq, body, ts, client=None):
+    """把一条消息写入倒排索引，一次往返完成"""
+    pipe = client or r.pipeline(transaction=False)
+    score = _score(ts)
+    for token in tokenize(body)[:MAX_TOKENS]:
+        pipe.zadd(token_key(room_id, token), {seq: score})
+    if client is None:
+        with redis_timer('search.index'):
+            pipe.execute()
+
+
+def search_messages(user_id, q, size, before=None):
+    """
+    在用户所在的房间（含全局房间）中搜索，按时间倒序返回 (结果, 下一页的分数上限)
+    before 为分数上限（毫秒，不含），用于翻页；没有更多结果时下一页上限为 None
+    """
+    tokens = tokenize(q, for_query=True)[:MAX_QUERY_TOKENS]
+    if not tokens:
+        return [], None
+    room_ids = [0] + sorted(rooms_of(user_id))
+    max_score = before if before is not None else '+inf'
+    min_score = '-inf'
+    budget = SCAN_BUDGET
+    hits = []
+    for start in range(0, len(room_ids), ROOM_BATCH):
+        batch = room_ids[start:start + ROOM_BATCH]
+        keys = [token_key(room_id, token) for room_id in batch for token in tokens]
+        with redis_timer('search.query'):
+            flat = _intersect(keys=keys, args=[len(tokens), size, max_score, min_score,
+                                               SCAN_LIMIT, budget, *batch])
+        budget -= int(flat[0])
+        hits.extend((int(room_id), int(seq), int(float(score)))
+                    for room_id, seq, score in zip(flat[1::3], flat[2::3], flat[3::3]))
+        hits = sorted(hits, key=lambda hit: hit[2], reverse=True)[:size]
+        if budget <= 0:
+            break
+        # 已凑满一页后，后续房间只需检查比当前第 size 条更新的消息
+        if len(hits) == size:
+            min_score = hits[-1][2]
+
+    if not hits:
+        return [], None
+
+    # 回表取原文：bigram 求交只是候选，原文包含查询串才算命中
+    rows = Message.query.filter(
+        tuple_(Message.room_id, Message.seq).in_([(room_id, seq) for room_id, seq, _ in hits])
+    ).all()
+    by_key = {(m.room_id, m.seq): m for m in rows}
+    names = User.usernames({m.sender for m in rows})
+    needle = q.strip().lower()
+
+    data = []
+    for room_id, seq, _ in hits:
+        msg = by_key.get((room_id, seq))
+        # 开启 write-behind 时消息可能尚未落库，暂不返回
+        if msg is None or needle not in (msg.body or '').lower():
+            continue
+        data.append({
+            'room_id': room_id,
+            'seq': seq,
+            'sender_id': msg.sender,
+            'sender': names.get(msg.sender) or msg.sender,
+            'body': msg.body,
+            'ts': msg.ts.isoformat()
+        })
+    # 游标按候选推进而不是按校验后的结果，被过滤掉的候选不会在下一页重复出现
+    return data, hits[-1][2] if len(hits) == size else None
+
+
+@search_bp.get('/messages')
+@jwt_required()
+@limiter.limit('30 per minute')
+def messages():
+    q = request.args.get('q', '').strip()
+    if not q:
+        return jsonify({'code': 1, 'msg': '搜索内容不能为空'}), 400
+    size = max(1, min(request.args.get('size', 20, type=int), 100))
+    before = None
+    cursor = request.args.get('cursor')
+    if cursor:
+        position = decode_cursor(cursor)
+        if position is None:
+            return jsonify({'code': 1, 'msg': '无效的游标'}), 400
+        before = position.get('before')
+
+    data, next_before = search_messages(get_jwt_identity(), q, size, before)
+    has_more = next_before is not None
+    return jsonify({'code': 0, 'data': data, 'has_more': has_more,
+                    'next_cursor': encode_cursor(before=next_before) if has_more else None}), 200
+
+
+def rebuild(batch_size=1000):
+    """清空并按 msg_id 顺序重建全部消息的倒排索引"""
+    for keys in _scan_batches(f'{KEY_PREFIX}:*'):
+        r.unlink(*keys)
+
+    engine = create_engine(database_uri(), pool_pre_ping=True)
+    table = Message.__table__
+    last_id, total = 0, 0
+    with engine.connect() as conn:
+        while True:
+            rows = conn.execute(
+                select(table.c.msg_id, table.c.room_id, table.c.seq, table.c.body, table.c.ts)
+                .where(table.c.msg_id > last_id).order_by(table.c.msg_id).limit(batch_size)
+            ).all()
+            if not rows:
+                break
+            pipe = r.pipeline(transaction=False)
+            for row in rows:
+                index_message(row.room_id, row.seq, row.body or '', row.ts, client=pipe)
+            pipe.execute()
+            last_id = rows[-1].msg_id
+            total += len(rows)
+            print(f'已索引 {total} 条消息')
+    return total
+
+
+def _scan_batches(pattern, count=1000):
+    batch = []
+    for key in r.scan_iter(match=pattern, count=count):
+        batch.append(key)
+        if len(batch) >= count:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+if __name__ == '__main__':
+    if sys.argv[1:] != ['rebuild']:
+        sys.exit('用法：python -m app.search rebuild')
+    rebuild()
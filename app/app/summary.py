@@ -0,0 +1,116 @@
+"""
+房间摘要：最新 seq + 最后一条消息预览
+- 保存在 Redis Hash room:{id}:summary，由 on_chat 增量更新；实时的摘要变化由客户端从 chat 事件推算
+- 未读数 = head_seq - last_read_seq，O(1) 计算
+- 缓存缺失时批量回源数据库并回填
+"""
+import redis
+
+from .models import db, Message, User
+from .utils import init_redis
+
+r = init_redis()
+
+PREVIEW_LEN = 50
+
+# 只有更大的 seq 才覆盖摘要，避免并发 worker 乱序写入导致回退
+_update_if_newer = r.register_script("""
+local cur = tonumber(redis.call('HGET', KEYS[1], 'head_seq') or '0')
+if tonumber(ARGV[1]) > cur then
+    redis.call('HSET', KEYS[1], 'head_seq', ARGV[1], 'sender_id', ARGV[2],
+               'sender', ARGV[3], 'preview', ARGV[4], 'ts', ARGV[5])
+    return 1
+end
+return 0
+""")
+
+
+def summary_key(room_id):
+    return f'room:{room_id}:summary'
+
+
+def _format(room_id, fields):
+    head_seq = int(fields.get('head_seq') or 0)
+    last_message = {
+        'sender_id': fields['sender_id'],
+        'sender': fields['sender'],
+        'preview': fields['preview'],
+        'ts': fields['ts']
+    } if head_seq else None
+    return {'room_id': room_id, 'head_seq': head_seq, 'last_message': last_message}
+
+
+def update_summary(room_id, seq, sender_id, sender, body, ts):
+    """on_chat 调用：推进房间摘要，返回新的摘要"""
+    fields = {
+        'head_seq': seq,
+        'sender_id': sender_id,
+        'sender': sender,
+        'preview': body[:PREVIEW_LEN],
+        'ts': ts
+    }
+    try:
+        _update_if_newer(keys=[summary_key(room_id)],
+                         args=[seq, sender_id, sender, fields['preview'], ts])
+    except redis.RedisError:
+        pass
+    return _format(room_id, fields)
+
+
+def get_summaries(room_ids):
+    """批量获取房间摘要，返回 {room_id: summary}"""
+    room_ids = list(room_ids)
+    try:
+        pipe = r.pipeline(transaction=False)
+        for room_id in room_ids:
+            pipe.hgetall(summary_key(room_id))
+        cached = pipe.execute()
+    except redis.RedisError:
+        cached = [{}] * len(room_ids)
+
+    summaries = {}
+    missing = []
+    for room_id, fields in zip(room_ids, cached):
+        if fields:
+            summaries[room_id] = _format(room_id, fields)
+        else:
+            missing.append(room_id)
+    if missing:
+        summaries.update(_load_summaries(missing))
+    return summaries
+
+
+def _load_summaries(room_ids):
+    # 一次查询取出各房间 seq 最大的消息
+    head = (db.session.query(Message.room_id, db.func.max(Message.seq).label('head_seq'))
+            .filter(Message.room_id.in_(room_ids))
+            .group_by(Message.room_id)
+            .subquery())
+    msgs = db.session.query(Message).join(
+        head, (Message.room_id == head.c.room_id) & (Message.seq == head.c.head_seq)
+    ).all()
+    usernames = User.usernames({m.sender for m in msgs})
+
+    summaries = {room_id: _format(room_id, {}) for room_id in room_ids}
+    pipe = r.pipeline(transaction=False)
+    for m in msgs:
+        fields = {
+            'head_seq': m.seq,
+            'sender_id': m.sender,
+            'sender': usernames[m.sender] or m.sender,
+            'preview': (m.body or '')[:PREVIEW_LEN],
+            'ts': m.ts.isoformat()
+        }
+        summaries[m.room_id] = _format(m.room_id, fields)
+        _update_if_newer(keys=[summary_key(m.room_id)], client=pipe,
+                         args=[fields['head_seq'], fields['sender_id'], fields['sender'],
+                               fields['preview'], fields['ts']])
+    # 没有消息的房间也回填，避免重复回源
+    for room_id in room_ids:
+        if not summaries[room_id]['head_seq']:
+            pipe.hsetnx(summary_key(room_id), 'head_seq', 0)
+    try:
+        pipe.execute()
+    except redis.RedisError:
+        pass
+    return summaries
@@ -0,0 +1,113 @@
+"""
+输入状态聚合
+- 每个连接先做进程内去重限流，重复状态直接丢弃，不访问数据库 / Redis
+- 输入状态存于 Redis 有序集合 room:{id}:typing，score 为过期时间
+- 每个周期由一个 worker 生成各房间"谁在输入"快照，仅在集合变化时广播
+"""
+import time
+
+import redis
+from flask import current_app
+
+from .extensions import socketio
+from .models import User
+from .utils import init_redis, redis_timer
+
+r = init_redis()
+
+TYPING_TTL = 5        # 输入状态有效期（秒），客户端需在此之前刷新
+TYPING_REFRESH = 3    # 同一连接同一状态的最小刷新间隔（秒）
+ACTIVE_ROOMS_KEY = 'typing:rooms'
+TICKER_KEY = 'typing:ticker'
+
+# sid -> (room_id, is_typing, 上次接受时间)
+_last_accepted = {}
+
+
+def typing_key(room_id):
+    return f'room:{room_id}:typing'
+
+
+def should_accept(sid, room_id, is_typing):
+    """同一连接在刷新间隔内重复上报相同状态时返回 False"""
+    now = time.monotonic()
+    last = _last_accepted.get(sid)
+    if last and last[0] == room_id and last[1] == is_typing and now - last[2] < TYPING_REFRESH:
+        return False
+    _last_accepted[sid] = (room_id, is_typing, now)
+    return True
+
+
+def forget(sid):
+    _last_accepted.pop(sid, None)
+
+
+def set_typing(room_id, user_id, is_typing):
+    with redis_timer('typing.set'):
+        pipe = r.pipeline()
+        if is_typing:
+            pipe.zadd(typing_key(room_id), {user_id: time.time() + TYPING_TTL})
+        else:
+            pipe.zrem(typing_key(room_id), user_id)
+        pipe.sadd(ACTIVE_ROOMS_KEY, room_id)
+        pipe.execute()
+
+
+def start_typing_broadcaster(app):
+    socketio.start_background_task(_run, app)
+
+
+def _run(app):
+    interval = app.config['TYPING_SNAPSHOT_INTERVAL_MS'] / 1000
+    while True:
+        socketio.sleep(interval)
+        try:
+            # 同一周期内只允许一个 worker 生成快照
+            if r.set(TICKER_KEY, 1, nx=True, px=max(1, int(interval * 900))):
+                # 每个周期使用新的应用上下文，避免 g 中的用户名缓存长期不过期
+                with app.app_context():
+                    _broadcast_snapshots()
+        except Exception as e:
+            # 任何异常都不能结束后台任务，否则所有 worker 的输入状态广播都会停止
+            app.logger.error(f'输入状态快照失败: {str(e)}')
+
+
+def _broadcast_snapshots():
+    now = time.time()
+    for room_id in r.smembers(ACTIVE_ROOMS_KEY):
+        try:
+            _broadcast_room(int(room_id), now)
+        except redis.RedisError:
+            raise
+        except Exception as e:
+            # 单个房间出错（例如非法的房间 ID）不影响其他房间，并移出活跃集合避免每个周期重复出错
+            current_app.logger.error(f'房间 {room_id} 输入状态快照失败: {str(e)}')
+            r.srem(ACTIVE_ROOMS_KEY, room_id)
+
+
+def _broadcast_room(room_id, now):
+    key = typing_key(room_id)
+    last_key = f'{key}:last'
+    pipe = r.pipeline()
+    pipe.zremrangebyscore(key, '-inf', now)
+    pipe.zrange(key, 0, -1)
+    pipe.get(last_key)
+    _, user_ids, last = pipe.execute()
+
+    user_ids = sorted(user_ids)
+    snapshot = ','.join(user_ids)
+    if snapshot != (last or ''):
+        usernames = User.usernames(user_ids)
+        socketio.emit('typing', {
+            'room_id': room_id,
+            'users': [{'user_id': user_id, 'username': usernames[user_id] or user_id}
+                      for user_id in user_ids]
+        }, room=str(room_id))
+        r.set(last_key, snapshot, ex=TYPING_TTL * 12)
+
+    if not user_ids:
+        # 房间内已无人输入，下次有输入时由 set_typing 重新登记
+        pipe = r.pipeline()
+        pipe.srem(ACTIVE_ROOMS_KEY, room_id)
+        pipe.delete(last_key)
+        pipe.execute()
@@ -1,59 +1,217 @@
 """
 文件上传
-- MIME 校验 + 后缀白名单
-- UUID 重命名
-- 图片压缩（JPEG 85%）
+- 直接解析请求体，文件内容边接收边落到临时文件，超过大小上限立即中止，内存占用与文件大小无关
+- 收到文件头部即做 MIME 校验 + 后缀白名单，不合格的上传不必等请求体传完
+- 按内容 SHA-256 去重存储：相同原始内容再次上传时直接返回已有地址，不再转码
+- 地址由内容哈希决定、永不变化，nginx 与浏览器可长期缓存
+- 图片压缩（JPEG 85%）交给独立的转码进程异步完成，完成后推送 upload_done 事件
+- 图片提供原图 / 中图 / 缩略图及 WebP 版本，?size= 选择尺寸
+- 转码队列积压过多时拒绝新上传
 """
+import hashlib
+import json
 import os
+import tempfile
 import uuid
-import io
-from PIL import Image
-from flask import Blueprint, request, send_from_directory
-from flask_jwt_extended import jwt_required
+from flask import Blueprint, request, send_from_directory, redirect
+from werkzeug.formparser import FormDataParser
+from flask_jwt_extended import jwt_required, get_jwt_identity
 from flask_limiter import Limiter
 import magic
 from flask_limiter.util import get_remote_address
 
+from .image_worker import UPLOAD_DIR, JOBS_KEY, SIZES, variant_urls
+from .models import db, UploadFile, UploadSource
+from .utils import init_redis
+
 upload_bp = Blueprint('upload', __name__, url_prefix='')
 limiter = Limiter(key_func=get_remote_address)
+r = init_redis()
 
-UPLOAD_DIR = os.path.join(os.path.dirname(__file__), 'upload')
-os.makedirs(UPLOAD_DIR, exist_ok=True)
+PENDING_DIR = os.path.join(UPLOAD_DIR, 'pending')
+os.makedirs(PENDING_DIR, exist_ok=True)
 
 ALLOW_EXT = {'jpg', 'jpeg', 'png', 'gif', 'pdf'}
+ALLOW_MIME = ('image/jpeg', 'image/png', 'image/gif', 'application/pdf')
 MAX_SIZE = 5 * 1024 * 1024  # 5 MB
+CHUNK_SIZE = 64 * 1024
+SNIFF_SIZE = 8 * 1024  # MIME 检测只需要文件头部
+MAX_PENDING_JOBS = int(os.getenv('UPLOAD_MAX_PENDING_JOBS', 200))  # 转码队列上限
 
 @upload_bp.post('/upload')
 @jwt_required()
 @limiter.limit('30 per minute')
 def upload():
-    f = request.files['file']
-    ext = f.filename.rsplit('.', 1)[-1].lower()
-    if ext not in ALLOW_EXT:
-        return {'code': 1, 'msg': '非法后缀'}, 415
-
-    blob = f.read()
-    if len(blob) > MAX_SIZE:
-        return {'code': 1, 'msg': '文件过大'}, 413
+    try:
+        filename, tmp_path, mime, source_hash = receive_file('file', MAX_SIZE, ALLOW_MIME, ALLOW_EXT)
+    except UploadRejected as e:
+        return {'code': 1, 'msg': e.msg}, e.status
+    ext = filename.rsplit('.', 1)[-1].lower()
 
-    mime = magic.from_buffer(blob, mime=True)
-    if mime not in ('image/jpeg', 'image/png', 'image/gif', 'application/pdf'):
-        return {'code': 1, 'msg': 'MIME 不符'}, 415
+    # 同样的原始内容已处理过：只增加引用计数，直接返回已有地址
+    source = UploadSource.query.get(source_hash)
+    if source:
+        os.remove(tmp_path)
+        UploadFile.add_ref(db.session, source.content_hash, source.file.ext, source_hash)
+        db.session.commit()
+        return _done(source.file)
 
+    name = uuid.uuid4().hex
     if mime.startswith('image'):
-        img = Image.open(io.BytesIO(blob))
-        img = img.convert('RGB')
-        out = io.BytesIO()
-        img.save(out, format='JPEG', quality=85, optimize=True)
-        blob = out.getvalue()
-        ext = 'jpg'
-
-    filename = f"{uuid.uuid4().hex}.{ext}"
-    path = os.path.join(UPLOAD_DIR, filename)
-    with open(path, 'wb') as fp:
-        fp.write(blob)
-    return {'code': 0, 'url': f'/upload/{filename}'}
+        # 队列积压时直接拒绝，避免原图在磁盘上无限堆积
+        if r.llen(JOBS_KEY) >= MAX_PENDING_JOBS:
+            os.remove(tmp_path)
+            return {'code': 1, 'msg': '服务器繁忙，请稍后重试'}, 503
+
+        src = os.path.join(PENDING_DIR, name)
+        os.replace(tmp_path, src)
+        r.lpush(JOBS_KEY, json.dumps({
+            'job_id': name,
+            'user_id': get_jwt_identity(),
+            'src': src,
+            'source_hash': source_hash
+        }))
+        # 最终地址由转码结果的哈希决定，完成前先返回可跳转到最终地址的源地址
+        url = f'/upload/src/{source_hash}'
+        return {'code': 0, 'url': url, 'variants': variant_urls(url), 'job_id': name, 'status': 'pending'}, 202
+
+    # PDF 不做转码，原始内容即输出内容
+    path = os.path.join(UPLOAD_DIR, f'{source_hash}.{ext}')
+    if os.path.exists(path):
+        os.remove(tmp_path)
+    else:
+        os.replace(tmp_path, path)
+    UploadFile.add_ref(db.session, source_hash, ext, source_hash)
+    db.session.commit()
+    return _done(UploadFile.query.get(source_hash))
+
+class UploadRejected(Exception):
+    def __init__(self, msg, status):
+        super().__init__(msg)
+        self.msg = msg
+        self.status = status
+
+class SpoolStream:
+    """
+    multipart 解析器的文件容器：每收到一块数据就累计大小、计算 SHA-256 并写入 PENDING_DIR 下的临时文件
+    头部攒够 SNIFF_SIZE 时立即做 MIME 检测；超过大小上限或 MIME 不符时抛出 UploadRejected，解析随之中止
+    """
+
+    def __init__(self, max_size, allow_mime):
+        self.max_size = max_size
+        self.allow_mime = allow_mime
+        fd, self.path = tempfile.mkstemp(dir=PENDING_DIR, suffix='.part')
+        self.fp = os.fdopen(fd, 'w+b')
+        self.digest = hashlib.sha256()
+        self.size = 0
+        self.head = b''
+        self.mime = None
+
+    def write(self, chunk):
+        self.size += len(chunk)
+        if self.size > self.max_size:
+            raise UploadRejected('文件过大', 413)
+        if self.mime is None:
+            self.head += chunk[:SNIFF_SIZE - len(self.head)]
+            if len(self.head) >= SNIFF_SIZE:
+                self._sniff()
+        self.digest.update(chunk)
+        return self.fp.write(chunk)
+
+    def finish(self):
+        """文件结束时调用：不足 SNIFF_SIZE 的小文件在此检测 MIME"""
+        if self.mime is None:
+            if not self.head:
+                raise UploadRejected('文件为空', 400)
+            self._sniff()
+        self.fp.close()
+
+    def _sniff(self):
+        self.mime = magic.from_buffer(self.head, mime=True)
+        if self.mime not in self.allow_mime:
+            raise UploadRejected('MIME 不符', 415)
+
+    def seek(self, *args):
+        return self.fp.seek(*args)
+
+    def close(self):
+        self.fp.close()
+
+    def discard(self):
+        self.fp.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+def receive_file(field, max_size, allow_mime, allow_ext=None):
+    """
+    直接解析 request.stream 中的 multipart 请求体，取出 field 对应的上传文件
+    文件内容由 SpoolStream 边接收边校验、落盘，不经过 werkzeug 默认的内存 / 临时文件缓冲
+    返回 (原文件名, 临时文件路径, MIME, 十六进制哈希)；不合格时删除临时文件并抛出 UploadRejected
+    """
+    streams = []
+
+    def stream_factory(total_content_length, content_type, filename, content_length=None):
+        # 文件头部（含文件名）到达时即检查后缀，不合格的文件内容不会被读取
+        if allow_ext is not None and (filename or '').rsplit('.', 1)[-1].lower() not in allow_ext:
+            raise UploadRejected('非法后缀', 415)
+        stream = SpoolStream(max_size, allow_mime)
+        streams.append(stream)
+        return stream
+
+    parser = FormDataParser(stream_factory=stream_factory,
+                            max_form_memory_size=request.max_form_memory_size,
+                            max_content_length=request.max_content_length,
+                            max_form_parts=request.max_form_parts,
+                            cls=request.parameter_storage_class)
+    try:
+        _, _, files = parser.parse(request.stream, request.mimetype, request.content_length,
+                                   request.mimetype_params)
+        f = files.get(field)
+        if f is None:
+            raise UploadRejected('未上传文件', 400)
+        if not f.filename:
+            raise UploadRejected('未选择文件', 400)
+        f.stream.finish()
+    except BaseException:
+        for stream in streams:
+            stream.discard()
+        raise
+    for stream in streams:
+        if stream is not f.stream:
+            stream.discard()
+    return f.filename, f.stream.path, f.stream.mime, f.stream.digest.hexdigest()
+
+def _done(upload_file):
+    resp = {'code': 0, 'url': upload_file.url, 'status': 'done'}
+    if upload_file.ext == 'jpg':
+        resp['variants'] = variant_urls(upload_file.url)
+    return resp
+
+@upload_bp.get('/upload/src/<source_hash>')
+def uploaded_source(source_hash):
+    # 转码完成后跳转到按内容哈希命名的地址，保留 ?size= 等参数
+    source = UploadSource.query.get(source_hash)
+    if not source:
+        return {'code': 1, 'msg': '文件处理中', 'status': 'pending'}, 404
+    url = source.file.url
+    if request.query_string:
+        url = f"{url}?{request.query_string.decode()}"
+    return redirect(url)
 
 @upload_bp.get('/upload/<path:name>')
 def uploaded_file(name):
-    return send_from_directory(UPLOAD_DIR, name)
+    # 与 nginx 规则一致：?size= 选择尺寸，浏览器支持 WebP 时优先返回 WebP
+    base, _, ext = name.rpartition('.')
+    if ext != 'jpg':
+        return send_from_directory(UPLOAD_DIR, name)
+
+    suffix = SIZES[request.args['size']][0] if request.args.get('size') in SIZES else ''
+    candidates = [f'{base}{suffix}.jpg', name]
+    if 'image/webp' in request.headers.get('Accept', ''):
+        candidates.insert(0, f'{base}{suffix}.webp')
+    for candidate in candidates:
+        if os.path.isfile(os.path.join(UPLOAD_DIR, candidate)):
+            resp = send_from_directory(UPLOAD_DIR, candidate, max_age=31536000)
+            resp.vary.add('Accept')
+            return resp
+    return {'code': 1, 'msg': '文件不存在'}, 404
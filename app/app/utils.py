@@ -1,13 +1,62 @@
 """
 公共工具：Redis、日志、蓝图常用
 """
+import base64
 import json, logging, structlog
 import os
+import socket
+import time
+import uuid
+from collections import defaultdict
+from contextlib import contextmanager
 import redis
 from flask import Flask
 
+# 当前 worker 进程的唯一标识，用于 Redis 消费组、在线状态心跳等
+# 容器重启后主机名与 PID 可能与旧进程相同，加随机后缀以免继承旧进程的会话与未确认消息
+WORKER_ID = f'{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}'
+
+def database_uri():
+    return (
+        f"mysql+pymysql://{os.getenv('MYSQL_USER')}:{os.getenv('MYSQL_PASSWORD')}"
+        f"@db:3306/{os.getenv('MYSQL_DATABASE')}?charset=utf8mb4"
+    )
+
+_redis_client = None
+
 def init_redis():
-    return redis.from_url(os.getenv('REDIS_URL', 'redis://redis:6379/0'), decode_responses=True)
+    """
+    返回进程内共享的 Redis 客户端
+    gevent 下并发 greenlet 很多，使用阻塞连接池：连接用尽时等待而不是直接报错
+    """
+    global _redis_client
+    if _redis_client is None:
+        pool = redis.BlockingConnectionPool.from_url(
+            os.getenv('REDIS_URL', 'redis://redis:6379/0'),
+            max_connections=int(os.getenv('REDIS_MAX_CONNECTIONS', 200)),
+            timeout=float(os.getenv('REDIS_POOL_TIMEOUT', 5)),
+            decode_responses=True
+        )
+        _redis_client = redis.Redis(connection_pool=pool)
+    return _redis_client
+
+# Redis 调用耗时统计：分组 -> {count, total_ms, max_ms}
+redis_stats = defaultdict(lambda: {'count': 0, 'total_ms': 0.0, 'max_ms': 0.0})
+REDIS_SLOW_MS = 50
+
+@contextmanager
+def redis_timer(group):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        stat = redis_stats[group]
+        stat['count'] += 1
+        stat['total_ms'] += elapsed_ms
+        stat['max_ms'] = max(stat['max_ms'], elapsed_ms)
+        if elapsed_ms > REDIS_SLOW_MS:
+            logging.getLogger(__name__).warning(f'Redis 慢调用 {group}: {elapsed_ms:.1f}ms')
 
 def setup_logger(app: Flask):
     structlog.configure(
@@ -25,5 +74,15 @@ def setup_logger(app: Flask):
     app.logger.handlers = gunicorn_logger.handlers
     app.logger.setLevel(logging.INFO)
 
-# JWT黑名单
-blacklist = set()
\ No newline at end of file
+
+def encode_cursor(**position):
+    # 游标对客户端不透明：base64(JSON)
+    return base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        position = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return {k: int(v) for k, v in position.items()}
+    except (ValueError, TypeError, AttributeError):
+        return None
@@ -0,0 +1,230 @@
+"""
+消息异步落库（write-behind）
+- 分配 seq 后立即返回，消息写入 Redis Stream 作为持久缓冲
+- 后台协程按批量大小 / 时间上限批量 INSERT 到 message 表
+- 启动及运行期间认领失联消费者的未确认消息，崩溃后可重放
+- 重放的消息按内容识别后跳过；序号被占用的消息重新分配序号写入，不会被丢弃
+- 无法解析的条目确认后移入死信 Stream，不阻塞同组的其他消息
+- 记录批量大小与落库延迟指标
+"""
+import time
+from datetime import datetime, timedelta
+
+import redis
+from flask import current_app
+from sqlalchemy import select, tuple_
+from sqlalchemy.exc import IntegrityError
+
+from .extensions import db, socketio
+from .models import Message, RoomSeq
+from .utils import init_redis, WORKER_ID
+
+r = init_redis()
+
+STREAM_KEY = 'message:stream'
+DEAD_LETTER_KEY = 'message:stream:dead'
+GROUP = 'message-writer'
+CONSUMER = WORKER_ID
+CLAIM_IDLE_MS = 60 * 1000  # 未确认超过 60 秒的消息视为消费者已失联
+
+# 落库指标（进程内）
+stats = {
+    'batches': 0,
+    'messages': 0,
+    'last_batch_size': 0,
+    'last_lag_ms': 0,
+    'max_lag_ms': 0,
+}
+
+
+def save_message(sender, body, room_id=0, type=0, status=0):
+    """持久化一条消息，返回 (seq, ts)；未开启 write-behind 或 Redis 不可用时同步落库"""
+    ts = datetime.utcnow()
+    if current_app.config['MESSAGE_WRITE_BEHIND']:
+        try:
+            seq = RoomSeq.allocate(room_id)
+            r.xadd(STREAM_KEY, {
+                'room_id': room_id,
+                'seq': seq,
+                'type': type,
+                'sender': sender,
+                'body': body,
+                'status': status,
+                'ts': ts.isoformat()
+            })
+            return seq, ts
+        except redis.RedisError:
+            current_app.logger.warning('write-behind 缓冲不可用，改为同步落库')
+    return Message.save(sender, body, room_id, type, status), ts
+
+
+def start_writer(app):
+    try:
+        r.xgroup_create(STREAM_KEY, GROUP, id='0', mkstream=True)
+    except redis.ResponseError as e:
+        if 'BUSYGROUP' not in str(e):
+            raise
+    socketio.start_background_task(_run, app)
+
+
+def _run(app):
+    batch_size = app.config['MESSAGE_FLUSH_BATCH']
+    interval = app.config['MESSAGE_FLUSH_INTERVAL_MS'] / 1000
+    with app.app_context():
+        # 先重放本进程遗留（id 为 0 表示读取已投递未确认的消息）及失联消费者的消息
+        _replay()
+        last_claim = time.monotonic()
+        while True:
+            try:
+                batch = _collect(batch_size, interval)
+                if batch:
+                    _flush(batch)
+                if time.monotonic() - last_claim > CLAIM_IDLE_MS / 1000:
+                    _claim_stale()
+                    last_claim = time.monotonic()
+            except Exception as e:
+                db.session.rollback()
+                app.logger.error(f'write-behind 落库失败: {str(e)}')
+                socketio.sleep(1)
+
+
+def _collect(batch_size, interval):
+    # 攒够 batch_size 条或等待超过 interval 秒即返回
+    batch = []
+    deadline = time.monotonic() + interval
+    while len(batch) < batch_size:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        resp = r.xreadgroup(GROUP, CONSUMER, {STREAM_KEY: '>'},
+                            count=batch_size - len(batch), block=max(1, int(remaining * 1000)))
+        if resp:
+            batch.extend(resp[0][1])
+    return batch
+
+
+def _replay():
+    while True:
+        resp = r.xreadgroup(GROUP, CONSUMER, {STREAM_KEY: '0'}, count=current_app.config['MESSAGE_FLUSH_BATCH'])
+        entries = [e for e in resp[0][1] if e[1]] if resp else []
+        if not entries:
+            break
+        _flush(entries)
+    _claim_stale()
+
+
+def _claim_stale():
+    start_id = '0-0'
+    while True:
+        resp = r.xautoclaim(STREAM_KEY, GROUP, CONSUMER, CLAIM_IDLE_MS, start_id=start_id,
+                            count=current_app.config['MESSAGE_FLUSH_BATCH'])
+        start_id, entries = resp[0], [e for e in resp[1] if e[1]]
+        if entries:
+            _flush(entries)
+        if start_id == '0-0':
+            break
+
+
+def _resolve_conflicts(rows):
+    """
+    处理与已落库消息相同 (room_id, seq) 的条目
+    - 发送者与内容一致：重放（例如确认前进程崩溃），跳过
+    - 不一致：序号被占用（计数从数据库重新初始化时未计入缓冲中的消息，或同步落库抢先使用），
+      重新分配序号后写入，不丢弃消息
+    """
+    table = Message.__table__
+    existing = {(row.room_id, row.seq): row for row in db.session.execute(
+        select(table.c.room_id, table.c.seq, table.c.sender, table.c.body)
+        .where(tuple_(table.c.room_id, table.c.seq).in_([(row['room_id'], row['seq']) for row in rows]))
+    )}
+    if not existing:
+        return rows
+
+    resolved = []
+    for row in rows:
+        found = existing.get((row['room_id'], row['seq']))
+        if found is None:
+            resolved.append(row)
+        elif found.sender != row['sender'] or found.body != row['body']:
+            # 之前已改用新序号写入、但确认前中断的消息，重放时不再重复写入
+            if _already_moved(row):
+                continue
+            old_seq = row['seq']
+            row['seq'] = RoomSeq.allocate(row['room_id'])
+            current_app.logger.warning(f"write-behind 房间 {row['room_id']} 序号 {old_seq} 已被占用，"
+                                       f"改用 {row['seq']}")
+            resolved.append(row)
+    return resolved
+
+
+def _already_moved(row):
+    # 按发送者、内容和时间（DATETIME 精度为秒，前后各放宽 1 秒）查找，只在序号冲突时才会执行
+    ts = row['ts']
+    return db.session.query(Message.query.filter(
+        Message.room_id == row['room_id'],
+        Message.sender == row['sender'],
+        Message.body == row['body'],
+        Message.ts.between(ts - timedelta(seconds=1), ts + timedelta(seconds=1))
+    ).exists()).scalar()
+
+
+def _parse(fields):
+    return {
+        'room_id': int(fields['room_id']),
+        'seq': int(fields['seq']),
+        'type': int(fields['type']),
+        'sender': fields['sender'],
+        'body': fields['body'],
+        'status': int(fields['status']),
+        'ts': datetime.fromisoformat(fields['ts'])
+    }
+
+
+def _dead_letter(entry_id, fields, error):
+    # 原样转存到死信 Stream 供人工排查，并从消费组中确认删除，否则每次重新认领都会再次失败
+    pipe = r.pipeline()
+    pipe.xadd(DEAD_LETTER_KEY, dict(fields, source_id=entry_id, error=str(error)))
+    pipe.xack(STREAM_KEY, GROUP, entry_id)
+    pipe.xdel(STREAM_KEY, entry_id)
+    pipe.execute()
+    current_app.logger.error(f'write-behind 条目 {entry_id} 无法解析，已移入死信: {str(error)}')
+
+
+def _flush(entries):
+    parsed = []
+    for entry_id, fields in entries:
+        try:
+            parsed.append((entry_id, _parse(fields)))
+        except (KeyError, ValueError) as e:
+            _dead_letter(entry_id, fields, e)
+    if not parsed:
+        return
+    entries = parsed
+    rows = [row for _, row in parsed]
+
+    rows = _resolve_conflicts(rows)
+    if rows:
+        try:
+            db.session.execute(Message.__table__.insert(), rows)
+            db.session.commit()
+        except IntegrityError:
+            # 检查之后又被同步落库抢占了序号：不确认这批消息，等待超时后重新认领再处理
+            db.session.rollback()
+            current_app.logger.warning(f'write-behind 序号冲突，{len(entries)} 条消息保留待重试')
+            return
+
+    ids = [entry_id for entry_id, _ in entries]
+    pipe = r.pipeline()
+    pipe.xack(STREAM_KEY, GROUP, *ids)
+    pipe.xdel(STREAM_KEY, *ids)
+    pipe.execute()
+
+    # Stream ID 的前半部分即入队时间（毫秒）
+    lag_ms = int(time.time() * 1000) - int(ids[0].split('-')[0])
+    stats['batches'] += 1
+    stats['messages'] += len(rows)
+    stats['last_batch_size'] = len(rows)
+    stats['last_lag_ms'] = lag_ms
+    stats['max_lag_ms'] = max(stats['max_lag_ms'], lag_ms)
+    current_app.logger.info(f'write-behind 落库 batch_size={len(rows)} lag_ms={lag_ms} '
+                            f'batches={stats["batches"]} messages={stats["messages"]}')
@@ -0,0 +1,46 @@
+"""
+经 Redis 消息队列跨 worker 广播的延迟
+两个 socketio.Server 模拟两个 worker，共享同一个 Redis；测量 A 发出到 B 的消息队列监听线程收到的耗时
+"""
+import threading
+import time
+
+import fakeredis
+import socketio
+
+from conftest import scaled, percentile, report
+
+
+def _worker(server):
+    manager = socketio.RedisManager('redis://bench:6379/0', channel='bench-fanout', redis_options={
+        'connection_class': fakeredis.FakeConnection, 'server': server
+    })
+    return socketio.Server(client_manager=manager, async_mode='threading')
+
+
+def test_cross_worker_fanout_latency():
+    server = fakeredis.FakeServer()
+    sender, receiver = _worker(server), _worker(server)
+    total = scaled(1000)
+    latencies = []
+    done = threading.Event()
+
+    def on_emit(message):
+        latencies.append(time.perf_counter() - message['data'][0]['sent_at'])
+        if len(latencies) == total:
+            done.set()
+
+    receiver.manager._handle_emit = on_emit
+    receiver.manager.initialize()
+    time.sleep(0.5)  # 等待订阅生效
+
+    start = time.perf_counter()
+    for i in range(total):
+        sender.emit('chat', {'seq': i, 'sent_at': time.perf_counter()}, room='1')
+    assert done.wait(60), f'只收到 {len(latencies)}/{total} 条'
+    elapsed = time.perf_counter() - start
+
+    report('跨 worker 广播延迟', messages=total,
+           throughput_per_s=total / elapsed,
+           p50_ms=percentile(latencies, 0.5) * 1000,
+           p99_ms=percentile(latencies, 0.99) * 1000)
@@ -0,0 +1,53 @@
+"""
+游标分页的深页延迟
+同一房间灌入大量消息，比较第 1 页与深页（游标 / OFFSET）的查询耗时
+"""
+from datetime import datetime
+
+from app.extensions import db
+from app.models import Message
+
+from conftest import make_user, make_room, scaled, report, Timer
+
+ROOM_ID = 10
+USER_ID = '10000001'
+PAGE_SIZE = 50
+ROUNDS = 20
+
+
+def _seed(total):
+    make_user(USER_ID)
+    make_room(ROOM_ID, [USER_ID])
+    now = datetime.utcnow()
+    for start in range(1, total + 1, 10000):
+        db.session.execute(Message.__table__.insert(), [
+            {'room_id': ROOM_ID, 'seq': seq, 'sender': USER_ID, 'body': f'm{seq}', 'ts': now}
+            for seq in range(start, min(start + 10000, total + 1))
+        ])
+    db.session.commit()
+
+
+def _avg_ms(fn):
+    with Timer() as timer:
+        for _ in range(ROUNDS):
+            fn()
+    return timer.elapsed / ROUNDS * 1000
+
+
+def test_deep_page_latency(app):
+    total = scaled(200000)
+    deep_seq = total // 100  # 从最新往前翻到 99% 处
+    with app.app_context():
+        _seed(total)
+        first = _avg_ms(lambda: Message.get_messages_for_room(ROOM_ID, PAGE_SIZE, before_seq=total + 1))
+        deep = _avg_ms(lambda: Message.get_messages_for_room(ROOM_ID, PAGE_SIZE, before_seq=deep_seq))
+        # 对照：原先的 LIMIT/OFFSET 写法
+        offset = total - deep_seq
+        deep_offset = _avg_ms(lambda: Message.query.filter_by(room_id=ROOM_ID)
+                              .order_by(Message.seq.desc()).offset(offset).limit(PAGE_SIZE).all())
+        assert [m['seq'] for m in Message.get_messages_for_room(ROOM_ID, PAGE_SIZE, before_seq=deep_seq)] == \
+            list(range(deep_seq - PAGE_SIZE, deep_seq))
+
+    report('历史消息深页延迟', messages=total, page=offset // PAGE_SIZE,
+           cursor_first_page_ms=first, cursor_deep_page_ms=deep, offset_deep_page_ms=deep_offset)
+    assert deep < deep_offset
@@ -0,0 +1,39 @@
+"""
+输入状态事件取用户名的吞吐，对比直接查库与两级资料缓存
+每个事件使用新的应用上下文，与后台快照任务一致，请求级的 identity map 不会跨事件复用
+"""
+import random
+
+from app.extensions import db
+from app.models import User, user_profiles
+
+from conftest import make_user, scaled, report, Timer
+
+
+def test_typing_username_lookup(app):
+    user_ids = [f'1{i:07d}' for i in range(200)]
+    events = scaled(5000)
+    rng = random.Random(0)
+    stream = [rng.choice(user_ids) for _ in range(events)]
+    with app.app_context():
+        for user_id in user_ids:
+            make_user(user_id)
+        db.session.commit()
+
+    with Timer() as uncached:
+        for user_id in stream:
+            with app.app_context():
+                User.find_by_id(user_id).username
+
+    before = dict(user_profiles.stats)
+    with Timer() as cached:
+        for user_id in stream:
+            with app.app_context():
+                User.get_username(user_id)
+    stats = {name: user_profiles.stats[name] - before[name] for name in before}
+
+    assert stats['misses'] <= len(user_ids)
+    report('输入状态事件取用户名', events=events,
+           db_events_per_s=events / uncached.elapsed,
+           cached_events_per_s=events / cached.elapsed,
+           local_hits=stats['local_hits'], redis_hits=stats['redis_hits'], misses=stats['misses'])
@@ -0,0 +1,43 @@
+"""
+滚动产生的大量已读回执合并后的数据库写入量
+原实现每条回执一次 SELECT + UPDATE + COMMIT；合并后每个周期一次批量 UPDATE
+"""
+import random
+
+from app.extensions import db
+from app.models import RoomMember
+from app.receipts import record_receipt, flush_receipts
+
+from conftest import make_user, make_room, scaled, report, Timer
+
+ROOMS = 20
+FLUSHES = 10
+
+
+def test_receipt_coalescing(app, count_queries):
+    user_ids = [f'1{i:07d}' for i in range(50)]
+    with app.app_context():
+        for user_id in user_ids:
+            make_user(user_id)
+        for room_id in range(1, ROOMS + 1):
+            make_room(room_id, user_ids)
+        db.session.commit()
+
+    per_flush = scaled(2000)
+    rng = random.Random(0)
+    received = 0
+    with app.app_context(), count_queries() as statements, Timer() as timer:
+        for round_ in range(FLUSHES):
+            # 每个周期内的回执 seq 大体递增，夹杂少量回退
+            for i in range(per_flush):
+                seq = round_ * per_flush + i - rng.randint(0, 5)
+                record_receipt(rng.randint(1, ROOMS), rng.choice(user_ids), seq)
+            received += per_flush
+            flush_receipts()
+
+    with app.app_context():
+        assert db.session.query(db.func.max(RoomMember.last_read_seq)).scalar() > 0
+    writes = [s for s in statements if s.lstrip().upper().startswith('UPDATE')]
+    report('已读回执合并', receipts=received, db_write_statements_before=received,
+           db_write_statements_after=len(writes), receipts_per_s=received / timer.elapsed)
+    assert len(writes) <= FLUSHES
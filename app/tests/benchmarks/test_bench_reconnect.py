@@ -0,0 +1,50 @@
+"""
+部署后的重连风暴
+所有用户同时重连，统计连接阶段的 SQL 语句数与每秒处理的连接数
+第一波从数据库加载成员集合并回填 Redis，之后的重连不再访问数据库
+"""
+from app import presence
+from app.extensions import db
+from app.models import Room, RoomMember
+
+from conftest import make_user, scaled, report, Timer
+
+ROOMS_PER_USER = 10
+
+
+def _storm(app, user_ids, wave):
+    with app.app_context(), Timer() as timer:
+        for user_id in user_ids:
+            rooms = presence.connect(f'{wave}-{user_id}', user_id)
+            assert len(rooms) == ROOMS_PER_USER
+    with app.app_context():
+        for user_id in user_ids:
+            presence.disconnect(f'{wave}-{user_id}')
+    return timer.elapsed
+
+
+def test_reconnect_storm(app, count_queries):
+    users = scaled(2000)
+    rooms = max(ROOMS_PER_USER, users // ROOMS_PER_USER)
+    user_ids = [f'1{i:07d}' for i in range(users)]
+    with app.app_context():
+        for user_id in user_ids:
+            make_user(user_id)
+        for room_id in range(1, rooms + 1):
+            db.session.add(Room(room_id=room_id, name=f'room{room_id}', group_flag=True, owner=user_ids[0]))
+        db.session.flush()
+        db.session.execute(RoomMember.__table__.insert(), [
+            {'room_id': (i * ROOMS_PER_USER + k) % rooms + 1, 'user_id': user_id, 'last_read_seq': 0}
+            for i, user_id in enumerate(user_ids) for k in range(ROOMS_PER_USER)
+        ])
+        db.session.commit()
+
+    with count_queries() as cold_statements:
+        cold = _storm(app, user_ids, 'cold')
+    with count_queries() as warm_statements:
+        warm = _storm(app, user_ids, 'warm')
+
+    report('重连风暴', users=users, rooms_per_user=ROOMS_PER_USER,
+           cold_sql_statements=len(cold_statements), warm_sql_statements=len(warm_statements),
+           cold_connects_per_s=users / cold, warm_connects_per_s=users / warm)
+    assert len(warm_statements) == 0
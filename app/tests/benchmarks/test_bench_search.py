@@ -0,0 +1,64 @@
+"""
+全文搜索查询延迟
+用户所在的多个房间中灌入中文消息并建立倒排索引，测量常见词与稀有词的查询延迟
+"""
+import random
+from datetime import datetime, timedelta
+
+from app.extensions import db
+from app.models import Message
+from app.search import index_message, search_messages
+
+from conftest import make_user, make_room, scaled, percentile, report, Timer
+
+USER_ID = '10000001'
+ROOMS = 20
+WORDS = ['今天', '天气', '不错', '晚上', '一起', '吃饭', '项目', '进度', '会议', '周末', '电影', '上线',
+         '测试', '服务器', '数据库', '部署', '明天', '早上', '咖啡', '讨论', 'redis', 'mysql', 'bug']
+
+
+def _seed(total):
+    rng = random.Random(0)
+    make_user(USER_ID)
+    for room_id in range(1, ROOMS + 1):
+        make_room(room_id, [USER_ID])
+    db.session.flush()
+    start = datetime.utcnow() - timedelta(seconds=total)
+    rows = []
+    for i in range(total):
+        room_id = i % ROOMS + 1
+        words = rng.sample(WORDS, 4)
+        if i % 1000 == 0:
+            words.append('年终总结')
+        rows.append({'room_id': room_id, 'seq': i // ROOMS + 1, 'sender': USER_ID,
+                     'body': '，'.join(words), 'ts': start + timedelta(seconds=i)})
+    db.session.execute(Message.__table__.insert(), rows)
+    db.session.commit()
+    for row in rows:
+        index_message(row['room_id'], row['seq'], row['body'], row['ts'])
+
+
+def _latencies(query, rounds=50):
+    samples = []
+    for _ in range(rounds):
+        with Timer() as timer:
+            data, _ = search_messages(USER_ID, query, 20)
+        samples.append(timer.elapsed * 1000)
+    return data, samples
+
+
+def test_search_latency(app):
+    total = scaled(50000)
+    with app.app_context():
+        _seed(total)
+        common, common_ms = _latencies('天气')
+        rare, rare_ms = _latencies('年终总结')
+        longer, longer_ms = _latencies('服务器')
+
+    assert len(common) == 20 and all('天气' in m['body'] for m in common)
+    assert rare and all('年终总结' in m['body'] for m in rare)
+    assert longer and all('服务器' in m['body'] for m in longer)
+    report('全文搜索', messages=total, rooms=ROOMS,
+           common_p50_ms=percentile(common_ms, 0.5), common_p99_ms=percentile(common_ms, 0.99),
+           rare_p50_ms=percentile(rare_ms, 0.5), rare_p99_ms=percentile(rare_ms, 0.99),
+           three_chars_p50_ms=percentile(longer_ms, 0.5))
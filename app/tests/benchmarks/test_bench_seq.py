@@ -0,0 +1,42 @@
+"""
+同一房间 N 个并发发送者争用序号分配器
+分配结果必须连续、无重复
+"""
+import threading
+
+from app.models import RoomSeq
+
+from conftest import scaled, report, Timer
+
+ROOM_ID = 42
+
+
+def test_concurrent_seq_allocation(app):
+    senders, per_sender = 32, scaled(500)
+    with app.app_context():
+        # 首次分配从数据库初始化计数键，之后只访问 Redis
+        first = RoomSeq.allocate(ROOM_ID)
+
+    allocated = [[] for _ in range(senders)]
+    barrier = threading.Barrier(senders)
+
+    def sender(i):
+        with app.app_context():
+            barrier.wait()
+            for _ in range(per_sender):
+                allocated[i].append(RoomSeq.allocate(ROOM_ID))
+
+    threads = [threading.Thread(target=sender, args=(i,)) for i in range(senders)]
+    with Timer() as timer:
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+    seqs = sorted(seq for chunk in allocated for seq in chunk)
+    total = senders * per_sender
+    assert seqs == list(range(first + 1, first + total + 1))
+    # 每个发送者拿到的序号单调递增
+    assert all(chunk == sorted(chunk) for chunk in allocated)
+    report('单房间并发序号分配', senders=senders, allocations=total,
+           allocations_per_s=total / timer.elapsed)
@@ -0,0 +1,99 @@
+"""
+上传突发期间的聊天延迟
+一批照片上传与一个定时发消息的客户端跑在同一个 gevent hub 上，统计每条聊天消息从预定发送时刻到收到 ack 的延迟；
+对照组（inline）在请求 greenlet 内同步转码，期间 hub 无法调度聊天；worker 模式下请求只落盘入队，转码由独立进程完成。
+同时校验队列积压到上限后拒绝新上传
+"""
+import io
+import random
+import threading
+import time
+
+import gevent
+from flask_jwt_extended import create_access_token
+from PIL import Image
+
+from app import upload
+from app.extensions import db, socketio
+from app.image_worker import transcode, JOBS_KEY
+
+from conftest import make_user, scaled, percentile, report
+
+USER_ID = '10000001'
+CHAT_INTERVAL = 0.01    # 聊天客户端每 10 ms 发一条
+UPLOAD_INTERVAL = 0.02  # 上传请求每 20 ms 到达一个
+
+
+def _photo(seed):
+    # 随机噪声图，压缩率接近真实照片
+    rng = random.Random(seed)
+    img = Image.frombytes('RGB', (1600, 1200), rng.randbytes(1600 * 1200 * 3))
+    out = io.BytesIO()
+    img.save(out, format='JPEG', quality=90)
+    return out.getvalue()
+
+
+def _burst(app, client, chat, photos, inline):
+    # 在新线程的独立 hub 上运行；主线程的 hub 上挂着 create_app 启动的后台任务，未打补丁时会阻塞整个 hub
+    result = {}
+    thread = threading.Thread(target=lambda: result.update(out=_run_burst(app, client, chat, photos, inline)))
+    thread.start()
+    thread.join()
+    return result['out']
+
+
+def _run_burst(app, client, chat, photos, inline):
+    upload.r.delete(JOBS_KEY)
+    statuses, chat_ms = [], []
+
+    def uploader(i, photo):
+        gevent.sleep(i * UPLOAD_INTERVAL)
+        resp = client.post('/upload', data={'file': (io.BytesIO(photo), f'{i}.jpg')},
+                           content_type='multipart/form-data')
+        statuses.append(resp.status_code)
+        if inline and resp.status_code == 202:
+            # 原实现在请求 greenlet 内转码，转码期间不让出 hub
+            transcode(photo)
+
+    def chatter(uploads):
+        due = time.perf_counter()
+        while not all(g.dead for g in uploads):
+            gevent.sleep(max(0, due - time.perf_counter()))
+            chat.emit('chat', {'room_id': 0, 'body': f'ping {len(chat_ms)}'}, callback=True)
+            chat_ms.append((time.perf_counter() - due) * 1000)
+            chat.get_received()
+            # 被阻塞期间错过的发送时刻不再补发，每条消息的延迟即它等待 hub 的时间
+            due = max(due + CHAT_INTERVAL, time.perf_counter())
+
+    with app.app_context():
+        uploads = [gevent.spawn(uploader, i, photo) for i, photo in enumerate(photos)]
+        gevent.joinall(uploads + [gevent.spawn(chatter, uploads)], raise_error=True)
+    return statuses, chat_ms
+
+
+def test_upload_burst(app, client, login, tmp_path, monkeypatch):
+    monkeypatch.setattr(upload, 'PENDING_DIR', str(tmp_path))
+    monkeypatch.setattr(upload, 'MAX_PENDING_JOBS', scaled(20))
+    with app.app_context():
+        make_user(USER_ID)
+        db.session.commit()
+        token = create_access_token(identity=USER_ID)
+    login(USER_ID)
+    chat = socketio.test_client(app, query_string=f'token={token}')
+    assert chat.is_connected()
+
+    uploads = upload.MAX_PENDING_JOBS + 5
+    photos = [_photo(i) for i in range(uploads)]
+
+    statuses, worker_ms = _burst(app, client, chat, photos, inline=False)
+    _, inline_ms = _burst(app, client, chat, photos, inline=True)
+    chat.disconnect()
+
+    assert statuses.count(202) == upload.MAX_PENDING_JOBS
+    assert statuses.count(503) == uploads - upload.MAX_PENDING_JOBS
+    assert upload.r.llen(JOBS_KEY) == upload.MAX_PENDING_JOBS
+    report('上传突发期间的聊天延迟', uploads=uploads, accepted=statuses.count(202),
+           rejected=statuses.count(503), inline_chat_messages=len(inline_ms), worker_chat_messages=len(worker_ms),
+           inline_chat_p50_ms=percentile(inline_ms, 0.5), inline_chat_p99_ms=percentile(inline_ms, 0.99),
+           worker_chat_p50_ms=percentile(worker_ms, 0.5), worker_chat_p99_ms=percentile(worker_ms, 0.99))
+    assert percentile(worker_ms, 0.99) < percentile(inline_ms, 0.99)
@@ -0,0 +1,107 @@
+"""
+并发上传的内存占用
+100 个并发的 5 MB 上传，请求体由生成器按需产生，tracemalloc 只统计服务端解析过程中的分配；
+对照组为原实现的 request.files + read() 整体读入内存
+"""
+import os
+import threading
+import tracemalloc
+
+from flask import request
+
+from app import upload
+
+from conftest import scaled, report, Timer
+
+BOUNDARY = 'benchboundary'
+FILE_SIZE = upload.MAX_SIZE - 1024
+
+
+class MultipartBody:
+    """按需生成的 multipart 请求体，不在内存中保留整个文件"""
+
+    def __init__(self, size):
+        self.head = (f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="file"; filename="a.pdf"\r\n'
+                     f'Content-Type: application/pdf\r\n\r\n%PDF-1.4\n').encode()
+        self.tail = f'\r\n--{BOUNDARY}--\r\n'.encode()
+        self.filler = size - len(b'%PDF-1.4\n')
+        self.length = len(self.head) + self.filler + len(self.tail)
+        self.pos = 0
+
+    def tell(self):
+        return self.pos
+
+    def seek(self, offset, whence=0):
+        self.pos = {0: offset, 1: self.pos + offset, 2: self.length + offset}[whence]
+        return self.pos
+
+    def read(self, n=-1):
+        n = self.length - self.pos if n is None or n < 0 else min(n, self.length - self.pos)
+        out = bytearray()
+        while len(out) < n:
+            pos = self.pos + len(out)
+            if pos < len(self.head):
+                out += self.head[pos:pos + n - len(out)]
+            elif pos < len(self.head) + self.filler:
+                out += b'x' * min(n - len(out), len(self.head) + self.filler - pos)
+            else:
+                start = pos - len(self.head) - self.filler
+                out += self.tail[start:start + n - len(out)]
+        self.pos += n
+        return bytes(out)
+
+
+def _parallel(app, handler, uploads):
+    # 所有上传同时开始，处理结果保留到全部完成，模拟同一 worker 上同时在途的请求
+    started, finished = threading.Barrier(uploads), threading.Barrier(uploads)
+    errors = []
+
+    def worker():
+        body = MultipartBody(FILE_SIZE)
+        with app.test_request_context('/upload', method='POST', input_stream=body,
+                                      content_type=f'multipart/form-data; boundary={BOUNDARY}',
+                                      content_length=body.length):
+            started.wait()
+            try:
+                result = handler()
+            except Exception as e:
+                errors.append(e)
+                result = None
+            finished.wait()
+            del result
+
+    threads = [threading.Thread(target=worker) for _ in range(uploads)]
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    with Timer() as timer:
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    assert not errors, errors
+    return peak / 1024 / 1024, timer.elapsed
+
+
+def test_parallel_upload_memory(app, tmp_path, monkeypatch):
+    monkeypatch.setattr(upload, 'PENDING_DIR', str(tmp_path))
+    uploads = scaled(100)
+
+    def streaming():
+        _, path, mime, _ = upload.receive_file('file', upload.MAX_SIZE, upload.ALLOW_MIME)
+        assert mime == 'application/pdf'
+        os.remove(path)
+        return path
+
+    def read_whole():
+        blob = request.files['file'].read()
+        assert len(blob) == FILE_SIZE
+        return blob
+
+    streaming_mb, streaming_s = _parallel(app, streaming, uploads)
+    whole_mb, whole_s = _parallel(app, read_whole, uploads)
+    report('并发上传内存', uploads=uploads, file_mb=FILE_SIZE / 1024 / 1024,
+           read_whole_peak_mb=whole_mb, streaming_peak_mb=streaming_mb,
+           read_whole_s=whole_s, streaming_s=streaming_s)
+    assert streaming_mb < whole_mb / 10
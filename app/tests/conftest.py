@@ -0,0 +1,164 @@
+"""
+测试环境：Redis 使用 fakeredis（含 Lua），数据库使用内存 SQLite
+app 包的各模块在导入时即调用 init_redis()，因此导入 app 时替换连接池，使共享客户端连到 fakeredis
+tests/benchmarks 下的基准测试默认跳过，PYCHAT_BENCH=1 时运行，BENCH_SCALE 按倍数调整数据规模
+"""
+import os
+import time
+from unittest import mock
+
+import fakeredis
+import lupa
+import lupa.lua51
+import pytest
+import redis
+from sqlalchemy import BigInteger, event
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.pool import StaticPool
+
+os.environ.setdefault('JWT_SECRET_KEY', 'test-secret-key-with-at-least-32-bytes')
+os.environ.setdefault('SECRET_KEY', 'test-secret-key-with-at-least-32-bytes')
+
+# Redis 内嵌的是 Lua 5.1（有全局 unpack 等），fakeredis 默认使用 lupa 的 5.4 运行时
+for _name in ('LuaRuntime', 'LuaError', 'as_attrgetter', 'lua_type'):
+    setattr(lupa, _name, getattr(lupa.lua51, _name))
+
+_fake_server = fakeredis.FakeServer()
+
+
+def _fake_pool(url, **kwargs):
+    return redis.ConnectionPool(connection_class=fakeredis.FakeConnection, server=_fake_server,
+                                decode_responses=kwargs.get('decode_responses', False))
+
+
+with mock.patch.object(redis.BlockingConnectionPool, 'from_url', _fake_pool):
+    from app import create_app, membership, utils  # noqa: E402
+from app.extensions import db  # noqa: E402
+from app.models import User, Room, RoomMember, Message, user_profiles  # noqa: E402
+
+
+BENCH_SCALE = float(os.getenv('BENCH_SCALE', 1))
+
+
+def pytest_collection_modifyitems(config, items):
+    if os.getenv('PYCHAT_BENCH') == '1':
+        return
+    skip = pytest.mark.skip(reason='基准测试，设置 PYCHAT_BENCH=1 运行')
+    for item in items:
+        if 'benchmarks' in item.path.parts:
+            item.add_marker(skip)
+
+
+@compiles(BigInteger, 'sqlite')
+def _bigint_as_integer(type_, compiler, **kw):
+    # SQLite 只有 INTEGER PRIMARY KEY 才会自增
+    return 'INTEGER'
+
+
+@pytest.fixture(scope='session')
+def app():
+    app = create_app({
+        'TESTING': True,
+        'SQLALCHEMY_DATABASE_URI': 'sqlite://',
+        'SQLALCHEMY_ENGINE_OPTIONS': {'poolclass': StaticPool,
+                                      'connect_args': {'check_same_thread': False}},
+        'SOCKETIO_MESSAGE_QUEUE': '',
+        'RATELIMIT_ENABLED': False,
+        # 周期性后台任务由用例直接调用，避免与用例并发访问数据库
+        'RECEIPT_FLUSH_INTERVAL_MS': 3600 * 1000,
+    })
+    with app.app_context():
+        # SQLite 没有 GREATEST，用多参数的 max 代替
+        event.listen(db.engine, 'connect',
+                     lambda conn, record: conn.create_function('GREATEST', -1, max))
+        db.create_all()
+    return app
+
+
+@pytest.fixture(autouse=True)
+def clean_state(app):
+    yield
+    with app.app_context():
+        db.session.remove()
+        for table in reversed(db.metadata.sorted_tables):
+            db.session.execute(table.delete())
+        db.session.commit()
+    utils.init_redis().flushall()
+    # 进程内缓存也要清空，否则会命中上一个用例的数据
+    membership._local_members.clear()
+    user_profiles.local.clear()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def login(app, client):
+    """以指定用户身份设置 JWT cookie"""
+    from flask_jwt_extended import create_access_token
+
+    def _login(user_id):
+        with app.app_context():
+            client.set_cookie('access_token_cookie', create_access_token(identity=user_id))
+    return _login
+
+
+@pytest.fixture
+def count_queries(app):
+    """统计块内执行的 SQL 语句数：with count_queries() as statements: ..."""
+    from contextlib import contextmanager
+
+    @contextmanager
+    def _count():
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        with app.app_context():
+            engine = db.engine
+        event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            yield statements
+        finally:
+            event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+    return _count
+
+
+def make_user(user_id, username=None):
+    db.session.add(User(user_id=user_id, username=username or f'u{user_id}', pwd_hash='x', salt='x'))
+
+
+def make_room(room_id, user_ids, group=True, messages=0):
+    db.session.add(Room(room_id=room_id, name=f'room{room_id}', group_flag=group, owner=user_ids[0]))
+    for user_id in user_ids:
+        db.session.add(RoomMember(room_id=room_id, user_id=user_id, last_read_seq=0))
+    for seq in range(1, messages + 1):
+        db.session.add(Message(room_id=room_id, seq=seq, sender=user_ids[seq % len(user_ids)], body=f'm{seq}'))
+
+
+def scaled(n):
+    return max(1, int(n * BENCH_SCALE))
+
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p))]
+
+
+def report(title, **metrics):
+    """基准测试结果统一输出，运行时加 -s 查看"""
+    print(f'\n[bench] {title}')
+    for name, value in metrics.items():
+        print(f'    {name:<28} {value:.3f}' if isinstance(value, float) else f'    {name:<28} {value}')
+
+
+class Timer:
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed = time.perf_counter() - self.start
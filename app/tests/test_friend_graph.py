@@ -0,0 +1,30 @@
+"""
+好友关系缓存
+"""
+from app import friend_graph
+from app.extensions import db
+from app.models import Friendship
+
+from conftest import make_user
+
+
+def _befriend(app, user_id, friend_id):
+    with app.app_context():
+        user_a, user_b = Friendship.pair(user_id, friend_id)
+        db.session.add(Friendship(user_a=user_a, user_b=user_b))
+        db.session.commit()
+
+
+def test_loaded_sentinel_is_not_a_friend(app):
+    with app.app_context():
+        for user_id in ('10000001', '10000002', '10000003'):
+            make_user(user_id)
+        db.session.commit()
+    _befriend(app, '10000001', '10000002')
+
+    with app.app_context():
+        # 第一次查询加载集合（含占位成员），之后走缓存
+        assert friend_graph.is_friend('10000001', '10000002')
+        assert not friend_graph.is_friend('10000001', friend_graph.LOADED)
+        assert friend_graph.friends_among('10000001', ['10000002', '10000003', friend_graph.LOADED]) == {'10000002'}
+        assert [f['user_id'] for f in friend_graph.friends_with_names('10000001')] == ['10000002']
@@ -0,0 +1,13 @@
+"""
+健康检查
+"""
+
+
+def test_health_is_public(client):
+    assert client.get('/health').get_json() == {'status': 'ok'}
+
+
+def test_redis_stats_require_login(client, login):
+    assert client.get('/health/redis').status_code == 401
+    login('10000001')
+    assert client.get('/health/redis').status_code == 200
@@ -0,0 +1,35 @@
+"""
+房间成员关系缓存
+"""
+from app import membership
+from app.extensions import db
+from app.models import RoomMember
+
+from conftest import make_user, make_room
+
+USER_ID = '10000001'
+OTHER_ID = '10000002'
+
+
+def test_stale_fill_after_removal_is_discarded(app):
+    with app.app_context():
+        make_user(USER_ID)
+        make_user(OTHER_ID)
+        make_room(10, [USER_ID, OTHER_ID])
+        db.session.commit()
+
+        class StaleQuery:
+            # 读库得到移除前的快照，返回前另一个请求完成了移除
+            def __iter__(self):
+                rows = [(USER_ID,), (OTHER_ID,)]
+                RoomMember.query.filter_by(room_id=10, user_id=OTHER_ID).delete()
+                db.session.commit()
+                membership.remove_members(10, [OTHER_ID])
+                return iter(rows)
+
+        key = membership.room_members_key(10)
+        assert membership._load_set(key, StaleQuery()) == {USER_ID, OTHER_ID}
+        # 旧快照没有回填，下次读取从数据库重新加载
+        assert not membership.r.exists(key)
+        assert membership.members_of(10) == {USER_ID}
+        assert membership.r.sismember(key, membership.LOADED)
@@ -0,0 +1,64 @@
+"""
+N+1 回归测试：接口执行的 SQL 语句数不随房间数、消息数增长
+"""
+import pytest
+
+from app import membership, utils
+from app.extensions import db
+from app.models import user_profiles
+
+from conftest import make_user, make_room
+
+USER_ID = '10000001'
+OTHERS = [f'2{i:07d}' for i in range(19)]
+
+
+@pytest.fixture
+def users(app):
+    with app.app_context():
+        for user_id in [USER_ID] + OTHERS:
+            make_user(user_id)
+        db.session.commit()
+
+
+def _add_rooms(app, room_ids, members=3, messages=2):
+    with app.app_context():
+        for room_id in room_ids:
+            make_room(room_id, [USER_ID] + OTHERS[:members - 1], group=room_id % 2 == 0, messages=messages)
+        db.session.commit()
+
+
+def _drop_caches():
+    # 每次都从数据库回源，缓存命中会掩盖 N+1
+    utils.init_redis().flushall()
+    membership._local_members.clear()
+    user_profiles.local.clear()
+
+
+@pytest.mark.parametrize('compact', [0, 1])
+def test_get_user_rooms_queries_do_not_grow_with_rooms(app, client, login, count_queries, users, compact):
+    login(USER_ID)
+    counts = []
+    for room_ids in (range(10, 12), range(12, 40)):
+        _add_rooms(app, room_ids)
+        _drop_caches()
+        with count_queries() as statements:
+            resp = client.get('/rooms/get_user_rooms', query_string={'compact': compact})
+        assert resp.status_code == 200
+        assert len(resp.get_json()['rooms']) == room_ids.stop - 10
+        counts.append(len(statements))
+    assert counts[0] == counts[1]
+
+
+def test_room_history_queries_do_not_grow_with_page_size(app, client, login, count_queries, users):
+    _add_rooms(app, [10], members=20, messages=100)
+    login(USER_ID)
+    counts = []
+    for size in (5, 50):
+        _drop_caches()
+        with count_queries() as statements:
+            resp = client.get('/room_history', query_string={'room_id': 10, 'size': size})
+        assert resp.status_code == 200
+        assert len(resp.get_json()['data']) == size
+        counts.append(len(statements))
+    assert counts[0] == counts[1]
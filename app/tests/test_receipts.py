@@ -0,0 +1,77 @@
+"""
+已读回执：合并落库与 Redis 故障时的降级
+"""
+import redis
+
+from app import receipts
+from app.extensions import db
+from app.models import RoomMember
+
+from conftest import make_user, make_room
+
+USER_ID = '10000001'
+
+
+def _last_read_seq(app):
+    with app.app_context():
+        return RoomMember.query.filter_by(room_id=10, user_id=USER_ID).one().last_read_seq
+
+
+def _setup(app):
+    with app.app_context():
+        make_user(USER_ID)
+        make_room(10, [USER_ID])
+        db.session.commit()
+
+
+def test_receipts_are_coalesced_and_never_regress(app):
+    _setup(app)
+    with app.app_context():
+        for seq in (3, 9, 5):
+            receipts.record_receipt(10, USER_ID, seq)
+        assert receipts.flush_receipts() == 1
+    assert _last_read_seq(app) == 9
+
+    with app.app_context():
+        receipts.record_receipt(10, USER_ID, 4)
+        receipts.flush_receipts()
+    assert _last_read_seq(app) == 9
+
+
+def test_receipt_falls_back_to_database_when_redis_fails(app, monkeypatch):
+    _setup(app)
+
+    def broken(*args, **kwargs):
+        raise redis.ConnectionError('down')
+
+    monkeypatch.setattr(receipts, '_record_if_newer', broken)
+    with app.app_context():
+        receipts.record_receipt(10, USER_ID, 7)
+    assert _last_read_seq(app) == 7
+
+    with app.app_context():
+        receipts.record_receipt(10, USER_ID, 2)
+    assert _last_read_seq(app) == 7
+
+
+def test_unparseable_receipt_does_not_drop_the_batch(app):
+    _setup(app)
+    with app.app_context():
+        receipts.r.hset(receipts.PENDING_KEY, f'True:{USER_ID}', 5)
+        receipts.record_receipt(10, USER_ID, 8)
+        assert receipts.flush_receipts() == 1
+    assert _last_read_seq(app) == 8
+
+
+def test_socket_receipt_requires_int_room_id(app, monkeypatch):
+    from app import message
+    recorded = []
+    monkeypatch.setattr(message, 'record_receipt', lambda *args: recorded.append(args))
+    monkeypatch.setattr(message, 'is_member', lambda room_id, user_id: True)
+    monkeypatch.setattr(message, 'socket_user_id', lambda: USER_ID)
+    handler = message.on_read_receipt.__wrapped__
+    for room_id in (True, 1.0, '1', None):
+        handler({'room_id': room_id, 'last_read_seq': 3})
+    handler({'room_id': 10, 'last_read_seq': True})
+    handler({'room_id': 10, 'last_read_seq': 3})
+    assert recorded == [(10, USER_ID, 3)]
@@ -0,0 +1,71 @@
+"""
+房间管理
+"""
+from app import name_index, room
+from app.extensions import db
+from app.models import Room, RoomMember, Friendship
+
+from conftest import make_user, make_room
+
+USER_ID = '10000001'
+
+
+def test_dissolved_group_leaves_name_index(app, client, login):
+    with app.app_context():
+        make_user(USER_ID)
+        make_room(10, [USER_ID])
+        db.session.commit()
+        name_index.index_name(name_index.GROUP, 10, 'room10')
+    login(USER_ID)
+    assert client.get('/rooms/search', query_string={'query': 'room10'}).get_json()['rooms'] == \
+        [{'room_id': 10, 'name': 'room10'}]
+
+    # 最后一名成员（群主）退出，群被解散
+    resp = client.post('/rooms/leave_room', json={'room_id': 10})
+    assert resp.status_code == 200
+    with app.app_context():
+        assert Room.query.get(10) is None
+    assert client.get('/rooms/search', query_string={'query': 'room10'}).get_json()['rooms'] == []
+    r = name_index.r
+    assert not r.hexists(name_index.names_key(name_index.GROUP), '10')
+    assert not any(r.zscore(name_index.gram_key(name_index.GROUP, gram), '10')
+                   for gram in name_index.grams('room10'))
+
+
+def test_create_private_accepts_numeric_target(app, client, login):
+    with app.app_context():
+        make_user(USER_ID)
+        make_user('10000002')
+        db.session.commit()
+    login(USER_ID)
+    # 数字 ID 与字符串 ID 按同一用户处理
+    resp = client.post('/rooms/create_private', json={'target_user_id': int(USER_ID)})
+    assert resp.status_code == 400 and resp.get_json()['msg'] == '不能与自己创建私聊'
+    resp = client.post('/rooms/create_private', json={'target_user_id': 10000002})
+    assert resp.status_code == 400 and resp.get_json()['msg'] == '只能与好友创建私聊'
+
+
+def test_add_member_emits_single_and_bulk_events(app, client, login, monkeypatch):
+    with app.app_context():
+        for user_id in (USER_ID, '10000002', '10000003'):
+            make_user(user_id)
+        make_room(10, [USER_ID])
+        for friend_id in ('10000002', '10000003'):
+            user_a, user_b = Friendship.pair(USER_ID, friend_id)
+            db.session.add(Friendship(user_a=user_a, user_b=user_b))
+        db.session.commit()
+    # SQLite 不支持 INSERT IGNORE
+    monkeypatch.setattr(room, '_insert_members', lambda room_id, user_ids: db.session.execute(
+        RoomMember.__table__.insert(), [{'room_id': room_id, 'user_id': u, 'last_read_seq': 0} for u in user_ids]))
+    events = []
+    monkeypatch.setattr(room.socketio, 'emit', lambda event, data, **kwargs: events.append((event, data)))
+    login(USER_ID)
+
+    assert client.post('/rooms/add_member', json={'room_id': 10, 'member_id': 10000002}).status_code == 200
+    assert ('new_member', {'room_id': 10, 'member_id': '10000002', 'username': 'u10000002'}) in events
+    assert 'new_members' not in [event for event, _ in events]
+
+    events.clear()
+    assert client.post('/rooms/add_members', json={'room_id': 10, 'member_ids': ['10000003']}).status_code == 200
+    assert ('new_members', {'room_id': 10, 'members': [{'member_id': '10000003', 'username': 'u10000003'}]}) in events
+    assert 'new_member' not in [event for event, _ in events]
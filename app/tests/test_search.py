@@ -0,0 +1,47 @@
+"""
+全文搜索：房间分批查询与候选检查预算
+"""
+from datetime import datetime, timedelta
+
+from app import search
+from app.extensions import db
+from app.models import Message
+
+from conftest import make_user, make_room
+
+USER_ID = '10000001'
+
+
+def _seed(app):
+    # 三个房间各一条包含 hello 的消息，房间号越大越新
+    base = datetime(2024, 1, 1)
+    with app.app_context():
+        make_user(USER_ID)
+        for room_id in (1, 2, 3):
+            make_room(room_id, [USER_ID])
+            ts = base + timedelta(minutes=room_id)
+            db.session.add(Message(room_id=room_id, seq=1, sender=USER_ID, body='hello', ts=ts))
+            search.index_message(room_id, 1, 'hello', ts)
+        db.session.commit()
+
+
+def test_search_merges_room_batches_by_time(app, monkeypatch):
+    _seed(app)
+    monkeypatch.setattr(search, 'ROOM_BATCH', 1)
+    with app.app_context():
+        data, next_before = search.search_messages(USER_ID, 'hello', 2)
+        assert [m['room_id'] for m in data] == [3, 2]
+        assert next_before is not None
+        data, next_before = search.search_messages(USER_ID, 'hello', 2, before=next_before)
+        assert [m['room_id'] for m in data] == [1]
+        assert next_before is None
+
+
+def test_search_stops_at_scan_budget(app, monkeypatch):
+    _seed(app)
+    monkeypatch.setattr(search, 'ROOM_BATCH', 1)
+    monkeypatch.setattr(search, 'SCAN_BUDGET', 2)
+    with app.app_context():
+        data, _ = search.search_messages(USER_ID, 'hello', 10)
+        # 全局房间为空，预算在房间 1、2 用完，房间 3 不再检查
+        assert [m['room_id'] for m in data] == [2, 1]
@@ -0,0 +1,98 @@
+"""
+上传：流式解析、大小上限、MIME 检测与头像文件名
+"""
+import io
+import os
+
+import pytest
+from PIL import Image
+
+from app import center, upload
+from app.extensions import db
+
+from conftest import make_user
+
+USER_ID = '10000001'
+
+
+@pytest.fixture
+def dirs(tmp_path, monkeypatch):
+    pending, avatar = tmp_path / 'pending', tmp_path / 'avatar'
+    pending.mkdir()
+    avatar.mkdir()
+    monkeypatch.setattr(upload, 'PENDING_DIR', str(pending))
+    monkeypatch.setattr(center, 'AVATAR_DIR', str(avatar))
+    return pending, avatar
+
+
+@pytest.fixture
+def user(app, login):
+    with app.app_context():
+        make_user(USER_ID)
+        db.session.commit()
+    login(USER_ID)
+
+
+def _png(size=(64, 64), color=(255, 0, 0)):
+    out = io.BytesIO()
+    Image.new('RGB', size, color).save(out, format='PNG')
+    return out.getvalue()
+
+
+def _post(client, url, field, data, filename):
+    return client.post(url, data={field: (io.BytesIO(data), filename)}, content_type='multipart/form-data')
+
+
+def test_upload_rejects_oversized_file(client, user, dirs, monkeypatch):
+    monkeypatch.setattr(upload, 'MAX_SIZE', 100 * 1024)
+    resp = _post(client, '/upload', 'file', b'%PDF-1.4\n' + os.urandom(200 * 1024), 'a.pdf')
+    assert resp.status_code == 413
+    assert not os.listdir(dirs[0])
+
+
+def test_upload_sniffs_small_file_at_eof(client, user, dirs):
+    # 小于 SNIFF_SIZE 的文件在结束时检测 MIME
+    png = _png()
+    assert len(png) < upload.SNIFF_SIZE
+    resp = _post(client, '/upload', 'file', png, 'a.png')
+    assert resp.status_code == 202
+    assert resp.get_json()['status'] == 'pending'
+
+
+def test_upload_sniffs_header_before_body_is_received(client, user, dirs, monkeypatch):
+    writes = []
+    original = upload.SpoolStream.write
+
+    def write(self, chunk):
+        writes.append(len(chunk))
+        return original(self, chunk)
+
+    monkeypatch.setattr(upload.SpoolStream, 'write', write)
+    resp = _post(client, '/upload', 'file', os.urandom(2 * 1024 * 1024), 'a.png')
+    assert resp.status_code == 415
+    # 头部攒够 SNIFF_SIZE 后立即拒绝，不再读取剩余内容
+    assert sum(writes) < 2 * 1024 * 1024
+    assert not os.listdir(dirs[0])
+
+
+def test_upload_rejects_extension_before_reading_content(client, user, dirs):
+    resp = _post(client, '/upload', 'file', _png(), 'a.exe')
+    assert resp.status_code == 415
+    assert resp.get_json()['msg'] == '非法后缀'
+    assert not os.listdir(dirs[0])
+
+
+def test_upload_requires_file_field(client, user, dirs):
+    resp = _post(client, '/upload', 'other', _png(), 'a.png')
+    assert resp.status_code == 400
+    assert not os.listdir(dirs[0])
+
+
+def test_avatar_url_changes_with_content(client, user, dirs):
+    first = _post(client, '/center/upload-avatar', 'avatar', _png(color=(255, 0, 0)), 'a.png').get_json()
+    second = _post(client, '/center/upload-avatar', 'avatar', _png(color=(0, 0, 255)), 'b.png').get_json()
+    assert first['code'] == 0 and second['code'] == 0
+    assert first['url'] != second['url']
+    assert second['url'].startswith(f'/upload/avatar/{USER_ID}-')
+    # 旧头像被删除，只保留当前文件
+    assert os.listdir(dirs[1]) == [second['url'].rsplit('/', 1)[-1]]
@@ -0,0 +1,36 @@
+"""
+消息异步落库
+"""
+from datetime import datetime
+
+from app import writer
+from app.extensions import db
+from app.models import Message
+
+from conftest import make_user, make_room
+
+
+def _fields(room_id, seq, body):
+    return {'room_id': room_id, 'seq': seq, 'type': 0, 'sender': '10000001', 'body': body,
+            'status': 0, 'ts': datetime.now().isoformat()}
+
+
+def test_unparseable_entry_goes_to_dead_letter(app):
+    with app.app_context():
+        make_user('10000001')
+        make_room(1, ['10000001'])
+        db.session.commit()
+
+        r = writer.r
+        r.xgroup_create(writer.STREAM_KEY, writer.GROUP, id='0', mkstream=True)
+        bad_id = r.xadd(writer.STREAM_KEY, _fields('1.0', 1, 'bad'))
+        r.xadd(writer.STREAM_KEY, _fields(1, 1, 'good'))
+        entries = r.xreadgroup(writer.GROUP, writer.CONSUMER, {writer.STREAM_KEY: '>'})[0][1]
+
+        writer._flush(entries)
+
+        assert [m.body for m in Message.query.filter_by(room_id=1).all()] == ['good']
+        dead = r.xrange(writer.DEAD_LETTER_KEY)
+        assert len(dead) == 1 and dead[0][1]['source_id'] == bad_id
+        # 坏条目也已确认，不会被反复认领
+        assert r.xpending(writer.STREAM_KEY, writer.GROUP)['pending'] == 0
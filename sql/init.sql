@@ -17,6 +17,8 @@ CREATE TABLE room (
     group_flag BOOLEAN,
     name VARCHAR(255),
     owner VARCHAR(30),
+    dm_key VARCHAR(17) NULL, -- 私聊双方 "较小ID:较大ID"，群聊为 NULL
+    UNIQUE KEY uk_room_dm_key (dm_key),
     FOREIGN KEY (owner) REFERENCES user(user_id)
 );
 INSERT INTO room (room_id, group_flag, name, owner) VALUE (1, TRUE, '默认群聊', '10000000');
@@ -31,16 +33,25 @@ CREATE TABLE message (
     body TEXT,
     status INT,
     ts DATETIME,
+    -- (room_id, seq) 同时保证序号唯一，并支撑历史消息的游标分页
+    UNIQUE KEY uk_message_room_seq (room_id, seq),
     FOREIGN KEY (room_id) REFERENCES room(room_id),
     FOREIGN KEY (sender) REFERENCES user(user_id)
 );
 
+-- 创建 房间消息序号计数表（Redis 不可用时的降级序号分配）
+CREATE TABLE room_seq (
+    room_id BIGINT PRIMARY KEY,
+    seq BIGINT NOT NULL DEFAULT 0
+);
+
 -- 创建 room_member 表
 CREATE TABLE room_member (
     id BIGINT AUTO_INCREMENT PRIMARY KEY,
     room_id BIGINT,
     user_id VARCHAR(30),
     last_read_seq BIGINT,
+    UNIQUE KEY uk_room_member (room_id, user_id),
     FOREIGN KEY (room_id) REFERENCES room(room_id),
     FOREIGN KEY (user_id) REFERENCES user(user_id)
 );
@@ -55,6 +66,35 @@ CREATE TABLE friend (
     friend_id VARCHAR(8),
     status INT, -- 0: 待处理，1: 已接受，2: 已拒绝
     request_time DATETIME DEFAULT CURRENT_TIMESTAMP,
+    KEY idx_friend_pair (user_id, friend_id, status),
+    KEY idx_friend_target (friend_id, status),
     FOREIGN KEY (user_id) REFERENCES user(user_id),
     FOREIGN KEY (friend_id) REFERENCES user(user_id)
 );
+
+-- 创建 好友关系表：每对好友按 (较小 ID, 较大 ID) 只存一行，两个方向各有索引
+CREATE TABLE friendship (
+    user_a VARCHAR(8) NOT NULL,
+    user_b VARCHAR(8) NOT NULL,
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (user_a, user_b),
+    KEY idx_friendship_b (user_b, user_a),
+    CHECK (user_a < user_b),
+    FOREIGN KEY (user_a) REFERENCES user(user_id),
+    FOREIGN KEY (user_b) REFERENCES user(user_id)
+);
+
+-- 创建 上传文件表（按转码后内容的 SHA-256 去重）
+CREATE TABLE upload_file (
+    content_hash CHAR(64) PRIMARY KEY,
+    ext VARCHAR(8) NOT NULL,
+    ref_count INT NOT NULL DEFAULT 0,
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+);
+
+-- 创建 原始上传内容到转码结果的映射表
+CREATE TABLE upload_source (
+    source_hash CHAR(64) PRIMARY KEY,
+    content_hash CHAR(64) NOT NULL,
+    FOREIGN KEY (content_hash) REFERENCES upload_file(content_hash)
+);
@@ -0,0 +1,112 @@
+-- 已有数据库的结构升级脚本
+-- init.sql 只在 MySQL 数据目录为空时由 docker-entrypoint-initdb 执行，已部署的实例需手动执行本脚本：
+--   docker compose exec -T db sh -c 'mysql -uroot -p"$MYSQL_ROOT_PASSWORD" "$MYSQL_DATABASE"' < sql/migrate.sql
+-- 每一步都先检查是否已完成，可重复执行
+
+DELIMITER //
+
+DROP PROCEDURE IF EXISTS pychat_add_column //
+CREATE PROCEDURE pychat_add_column(IN tbl VARCHAR(64), IN col VARCHAR(64), IN ddl TEXT)
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM information_schema.columns
+                   WHERE table_schema = DATABASE() AND table_name = tbl AND column_name = col) THEN
+        SET @ddl = CONCAT('ALTER TABLE ', tbl, ' ADD COLUMN ', ddl);
+        PREPARE stmt FROM @ddl;
+        EXECUTE stmt;
+        DEALLOCATE PREPARE stmt;
+    END IF;
+END //
+
+DROP PROCEDURE IF EXISTS pychat_add_index //
+CREATE PROCEDURE pychat_add_index(IN tbl VARCHAR(64), IN idx VARCHAR(64), IN ddl TEXT)
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM information_schema.statistics
+                   WHERE table_schema = DATABASE() AND table_name = tbl AND index_name = idx) THEN
+        SET @ddl = CONCAT('ALTER TABLE ', tbl, ' ADD ', ddl);
+        PREPARE stmt FROM @ddl;
+        EXECUTE stmt;
+        DEALLOCATE PREPARE stmt;
+    END IF;
+END //
+
+DELIMITER ;
+
+-- 消息序号：(room_id, seq) 唯一
+-- 旧数据中同一房间存在重复序号时，先按 msg_id 顺序重新编号，否则唯一索引无法建立
+UPDATE message m
+JOIN (
+    SELECT msg_id, ROW_NUMBER() OVER (PARTITION BY room_id ORDER BY msg_id) AS new_seq
+    FROM message
+) x ON m.msg_id = x.msg_id
+SET m.seq = x.new_seq
+WHERE NOT EXISTS (SELECT 1 FROM information_schema.statistics
+                  WHERE table_schema = DATABASE() AND table_name = 'message'
+                    AND index_name = 'uk_message_room_seq')
+  AND EXISTS (SELECT 1 FROM (SELECT room_id, seq FROM message GROUP BY room_id, seq HAVING COUNT(*) > 1) d);
+CALL pychat_add_index('message', 'uk_message_room_seq', 'UNIQUE KEY uk_message_room_seq (room_id, seq)');
+
+-- 房间消息序号计数表（Redis 不可用时的降级序号分配）
+CREATE TABLE IF NOT EXISTS room_seq (
+    room_id BIGINT PRIMARY KEY,
+    seq BIGINT NOT NULL DEFAULT 0
+);
+
+-- 房间成员：(room_id, user_id) 唯一，建索引前删除重复的成员行（保留最早的一行）
+DELETE rm FROM room_member rm
+JOIN room_member keep ON keep.room_id = rm.room_id AND keep.user_id = rm.user_id AND keep.id < rm.id;
+CALL pychat_add_index('room_member', 'uk_room_member', 'UNIQUE KEY uk_room_member (room_id, user_id)');
+
+-- 好友申请的查询索引
+CALL pychat_add_index('friend', 'idx_friend_pair', 'KEY idx_friend_pair (user_id, friend_id, status)');
+CALL pychat_add_index('friend', 'idx_friend_target', 'KEY idx_friend_target (friend_id, status)');
+
+-- 好友关系表，并由已接受的好友申请回填
+CREATE TABLE IF NOT EXISTS friendship (
+    user_a VARCHAR(8) NOT NULL,
+    user_b VARCHAR(8) NOT NULL,
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (user_a, user_b),
+    KEY idx_friendship_b (user_b, user_a),
+    CHECK (user_a < user_b),
+    FOREIGN KEY (user_a) REFERENCES user(user_id),
+    FOREIGN KEY (user_b) REFERENCES user(user_id)
+);
+INSERT IGNORE INTO friendship (user_a, user_b, created_at)
+SELECT LEAST(user_id, friend_id), GREATEST(user_id, friend_id), MIN(request_time)
+FROM friend WHERE status = 1 AND user_id <> friend_id
+GROUP BY LEAST(user_id, friend_id), GREATEST(user_id, friend_id);
+
+-- 上传文件（按内容哈希去重）
+CREATE TABLE IF NOT EXISTS upload_file (
+    content_hash CHAR(64) PRIMARY KEY,
+    ext VARCHAR(8) NOT NULL,
+    ref_count INT NOT NULL DEFAULT 0,
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TABLE IF NOT EXISTS upload_source (
+    source_hash CHAR(64) PRIMARY KEY,
+    content_hash CHAR(64) NOT NULL,
+    FOREIGN KEY (content_hash) REFERENCES upload_file(content_hash)
+);
+
+-- 私聊按双方 ID 唯一：新增 dm_key，为现存私聊回填（同一对用户有多个私聊时保留最早的房间）
+CALL pychat_add_column('room', 'dm_key', 'dm_key VARCHAR(17) NULL AFTER owner');
+UPDATE room r
+JOIN (
+    SELECT MIN(p.room_id) AS room_id, p.dm_key
+    FROM (
+        SELECT rm.room_id, CONCAT(MIN(rm.user_id), ':', MAX(rm.user_id)) AS dm_key
+        FROM room_member rm
+        JOIN room ro ON ro.room_id = rm.room_id AND ro.group_flag = FALSE
+        GROUP BY rm.room_id
+        HAVING COUNT(DISTINCT rm.user_id) = 2
+    ) p
+    WHERE NOT EXISTS (SELECT 1 FROM room taken WHERE taken.dm_key = p.dm_key)
+    GROUP BY p.dm_key
+) d ON r.room_id = d.room_id
+SET r.dm_key = d.dm_key
+WHERE r.dm_key IS NULL;
+CALL pychat_add_index('room', 'uk_room_dm_key', 'UNIQUE KEY uk_room_dm_key (dm_key)');
+
+DROP PROCEDURE IF EXISTS pychat_add_column;
+DROP PROCEDURE IF EXISTS pychat_add_index;